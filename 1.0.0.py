@@ -1,20 +1,19 @@
 # YiffScraper CLI v1.0.0
 
-import pystyle
-import asyncio
 import time
-import aiohttp
-import aiofiles
 import os
-from zipfile import ZipFile
 import sys
 import logging
-import requests
-import json
-import hashlib
-from threading import Lock
-from datetime import datetime
-os.system('cls' if os.name == 'nt' else 'clear')
+
+from yiffscraper import (
+    HEADERS, check_credentials, DownloadHistory, DownloadTracker, DuplicateDetector, format_size,
+    lazy_import, ProgressBar, scrape, zip_folder,
+)
+
+# Heavy modules load on first use so the prompts show up right away
+pystyle = lazy_import("pystyle")
+asyncio = lazy_import("asyncio")
+aiohttp = lazy_import("aiohttp")
 
 # Configure logging
 logging.basicConfig(
@@ -24,145 +23,6 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-HEADERS = {'User-Agent': 'Yiffscraper v4.1.0 CLI (by axo!)'}
-BASE_URL = "https://e621.net/posts.json?tags={}&limit={}"
-HISTORY_FILE = "download_history.json"
-
-class ProgressBar:
-    def __init__(self, total, width=50):
-        self.total = total
-        self.width = width
-        self.current = 0
-        self.start_time = time.time()
-        
-    def update(self, current):
-        self.current = current
-        percentage = (current / self.total) * 100 if self.total > 0 else 0
-        filled = int(self.width * current / self.total) if self.total > 0 else 0
-        bar = '█' * filled + '░' * (self.width - filled)
-        
-        elapsed = time.time() - self.start_time
-        if elapsed > 0 and current > 0:
-            speed = current / elapsed
-            eta = (self.total - current) / speed if speed > 0 else 0
-            eta_str = f"ETA: {int(eta)}s"
-        else:
-            eta_str = "ETA: --"
-            
-        print(f"\r[{bar}] {percentage:6.1f}% ({current}/{self.total}) {eta_str}", end='', flush=True)
-        
-    def finish(self):
-        self.update(self.total)
-        print()  # New line after completion
-
-class DownloadTracker:
-    def __init__(self):
-        self.downloaded_size = 0
-        self.total_estimated_size = 0
-        self.download_speed = 0
-        self.start_time = None
-        self.last_update_time = None
-        self.last_downloaded_size = 0
-        self.lock = Lock()
-        
-    def update_size(self, file_size):
-        with self.lock:
-            self.downloaded_size += file_size
-            current_time = time.time()
-            
-            if self.start_time is None:
-                self.start_time = current_time
-                self.last_update_time = current_time
-                
-            # Update speed calculation
-            if current_time - self.last_update_time >= 1.0:
-                time_diff = current_time - self.last_update_time
-                size_diff = self.downloaded_size - self.last_downloaded_size
-                self.download_speed = size_diff / time_diff
-                self.last_update_time = current_time
-                self.last_downloaded_size = self.downloaded_size
-    
-    def get_stats(self):
-        with self.lock:
-            downloaded_mb = self.downloaded_size / (1024 * 1024)
-            speed_mb = self.download_speed / (1024 * 1024)
-            return downloaded_mb, speed_mb
-
-class DownloadHistory:
-    def __init__(self, history_file=HISTORY_FILE):
-        self.history_file = history_file
-        self.history = self.load_history()
-
-    def load_history(self):
-        try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"Error loading history: {e}")
-        return []
-
-    def save_history(self):
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.history, f, indent=2)
-        except Exception as e:
-            print(f"Error saving history: {e}")
-
-    def add_entry(self, query_tags, count, total_size, duration, folder_name, skipped_duplicates=0):
-        entry = {
-            'timestamp': datetime.now().isoformat(),
-            'query_tags': query_tags,
-            'file_count': count,
-            'total_size_bytes': total_size,
-            'duration_seconds': duration,
-            'folder_name': folder_name,
-            'avg_speed_mbps': (total_size / (1024 * 1024)) / (duration / 60) if duration > 0 else 0,
-            'skipped_duplicates': skipped_duplicates
-        }
-        self.history.append(entry)
-        self.save_history()
-
-class DuplicateDetector:
-    def __init__(self, download_folder):
-        self.download_folder = download_folder
-        self.file_hashes = {}
-        self.load_existing_hashes()
-
-    def get_file_hash(self, filepath):
-        hash_md5 = hashlib.md5()
-        try:
-            with open(filepath, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        except Exception:
-            return None
-
-    def get_data_hash(self, data):
-        return hashlib.md5(data).hexdigest()
-
-    def load_existing_hashes(self):
-        if not os.path.exists(self.download_folder):
-            return
-
-        for filename in os.listdir(self.download_folder):
-            filepath = os.path.join(self.download_folder, filename)
-            if os.path.isfile(filepath):
-                file_hash = self.get_file_hash(filepath)
-                if file_hash:
-                    self.file_hashes[file_hash] = filename
-
-    def is_duplicate(self, data, post_id):
-        data_hash = self.get_data_hash(data)
-        if data_hash in self.file_hashes:
-            return True, self.file_hashes[data_hash]
-        return False, None
-
-    def add_hash(self, data, filename):
-        data_hash = self.get_data_hash(data)
-        self.file_hashes[data_hash] = filename
-
 def key_asterisk(prompt):
     """
     Secure input function that hides characters with asterisks
@@ -302,155 +162,6 @@ def key_asterisk_all(prompt):
     else:  # Unix-like systems
         return key_asterisk(prompt)
 
-async def download_file(sem, file_url, post_id, session, download_folder, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True, progress_callback=None):
-    async with sem:
-        try:
-            if debug:
-                print(f"\n[DEBUG] Downloading post {post_id} from {file_url}")
-
-            async with session.get(file_url, headers=HEADERS, auth=auth, cookies=cookies) as response:
-                if response.status == 200:
-                    ext = file_url.split('.')[-1]
-                    fname = f"{post_id}.{ext}"
-                    path = os.path.join(download_folder, fname)
-                    data = await response.read()
-
-                    # Check for duplicates
-                    if duplicate_detector and skip_duplicates:
-                        is_dup, existing_file = duplicate_detector.is_duplicate(data, post_id)
-                        if is_dup:
-                            if debug:
-                                print(f"\n[DEBUG] Skipping duplicate {post_id} (matches {existing_file})")
-                            return "duplicate"
-
-                    # Track download size
-                    file_size = len(data)
-                    if tracker:
-                        tracker.update_size(file_size)
-
-                    async with aiofiles.open(path, 'wb') as f:
-                        await f.write(data)
-
-                    # Add to duplicate detector
-                    if duplicate_detector:
-                        duplicate_detector.add_hash(data, fname)
-
-                    if debug:
-                        print(f"\n[DEBUG] Saved {fname} ({file_size} bytes)")
-                    
-                    if progress_callback:
-                        progress_callback()
-                        
-                    return "completed"
-                else:
-                    if debug:
-                        print(f"\n[DEBUG] HTTP {response.status} for post {post_id}")
-                    return "error"
-        except Exception as e:
-            if debug:
-                print(f"\n[DEBUG] Exception {e}")
-            return "error"
-
-async def start_scraper(query_tags, total_images, thread_limit, download_folder, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True):
-    os.makedirs(download_folder, exist_ok=True)
-    sem = asyncio.Semaphore(thread_limit)
-    downloaded = 0
-    skipped_duplicates = 0
-    page = 1
-
-    def update_progress():
-        nonlocal downloaded
-        downloaded += 1
-
-    async with aiohttp.ClientSession(auth=auth, cookies=cookies) as session:
-        while downloaded < total_images:
-            batch = min(320, total_images - downloaded)
-            params = {
-                "tags": query_tags,
-                "limit": str(batch),
-                "page": str(page)
-            }
-
-            if debug:
-                print(f"\n[DEBUG] GET posts.json → params={params!r}")
-
-            async with session.get(
-                    "https://e621.net/posts.json",
-                    params=params,
-                    headers=HEADERS
-            ) as resp:
-                if resp.status != 200:
-                    if debug:
-                        print(f"\n[DEBUG] HTTP {resp.status} — stopping")
-                    break
-                data = await resp.json()
-
-            posts = data.get("posts", [])
-            if not posts:
-                if debug:
-                    print(f"\n[DEBUG] No posts on page {page} — stopping")
-                break
-
-            # enqueue downloads
-            tasks = []
-            for post in posts:
-                file_url = post.get("file", {}).get("url") or post.get("sample", {}).get("url")
-                if file_url:
-                    tasks.append(download_file(
-                        sem, file_url, post["id"], session,
-                        download_folder, debug, auth, cookies,
-                        tracker, duplicate_detector, skip_duplicates,
-                        update_progress
-                    ))
-
-            if not tasks:
-                if debug:
-                    print(f"\n[DEBUG] No download URLs found on page {page} — stopping")
-                break
-
-            if debug:
-                print(f"\n[DEBUG] Page {page}: scheduling {len(tasks)} downloads")
-
-            results = await asyncio.gather(*tasks)
-
-            # Count skipped duplicates
-            for result in results:
-                if result == "duplicate":
-                    skipped_duplicates += 1
-
-            if debug:
-                print(f"\n[DEBUG] Total downloaded: {downloaded}, Skipped duplicates: {skipped_duplicates}")
-
-            # If fewer posts returned than requested, we've reached the end
-            if len(posts) < batch:
-                if debug:
-                    print(f"\n[DEBUG] Only {len(posts)} posts on page {page} (<{batch}) — done")
-                break
-
-            page += 1
-            await asyncio.sleep(1)  # respect rate limit
-
-        if debug:
-            print("\n[DEBUG] Scraping complete.")
-
-        return downloaded, skipped_duplicates
-
-def zip_folder(src_folder, dest_zip_file):
-    with ZipFile(dest_zip_file, 'w') as zipf:
-        for foldername, _, filenames in os.walk(src_folder):
-            for filename in filenames:
-                filepath = os.path.join(foldername, filename)
-                arcname = os.path.relpath(filepath, src_folder)
-                zipf.write(filepath, arcname)
-
-def format_size(bytes_size):
-    """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if bytes_size < 1024.0:
-            return f"{bytes_size:.1f} {unit}"
-        bytes_size /= 1024.0
-    return f"{bytes_size:.1f} TB"
-
 def get_credentials():
     """Get login credentials from user"""
     print()
@@ -477,16 +188,14 @@ def get_credentials():
             
         # Test credentials
         print("[DEBUG] Testing credentials...")
-        test_url = "https://e621.net/posts.json?tags=rating:safe&limit=1"
-        auth = (username, api_key)
-        r = requests.get(test_url, auth=auth, headers=HEADERS)
+        status = asyncio.run(check_credentials(username, api_key))
         
-        if r.status_code == 200:
+        if status == 200:
             print(f"[DEBUG] Successfully logged in as '{username}'")
             time.sleep(1)
             return username, api_key
         else:
-            print(f"[DEBUG] Authentication failed (HTTP {r.status_code})")
+            print(f"[DEBUG] Authentication failed (HTTP {status})")
             time.sleep(1)
             return None, None
     else:
@@ -566,14 +275,15 @@ def get_download_options():
         'debug': debug
     }
 
-def estimate_total_size(query_tags, post_count, auth=None):
+async def estimate_total_size(query_tags, post_count, auth=None):
     """Estimate total download size by sampling posts"""
     try:
         url = f"https://e621.net/posts.json?tags={query_tags}&limit=10"
-        r = requests.get(url, auth=auth, headers=HEADERS)
+        async with aiohttp.ClientSession(auth=auth) as session:
+            async with session.get(url, headers=HEADERS) as r:
+                data = await r.json() if r.status == 200 else None
         
-        if r.status_code == 200:
-            data = r.json()
+        if data is not None:
             posts = data.get('posts', [])
             if posts:
                 total_sample_size = 0
@@ -618,10 +328,7 @@ async def run_cli_scraper(options, username=None, api_key=None):
     print(f"Skip duplicates: {options['skip_duplicates']}")
     
     # Estimate download size
-    if auth:
-        estimated_size = estimate_total_size(options['tags'], options['post_count'], (username, api_key))
-    else:
-        estimated_size = estimate_total_size(options['tags'], options['post_count'])
+    estimated_size = await estimate_total_size(options['tags'], options['post_count'], auth)
     
     if estimated_size > 0:
         print(f"Estimated download size: {format_size(estimated_size)}")
@@ -644,17 +351,24 @@ async def run_cli_scraper(options, username=None, api_key=None):
     progress_thread.start()
     
     # Run the scraper
-    downloaded_count, skipped_count = await start_scraper(
+    downloaded_count = 0
+    skipped_count = 0
+    async for result in scrape(
         query_tags=options['tags'],
-        total_posts=options['post_count'],
-        thread_limit=options['thread_count'],
+        total_images=options['post_count'],
         download_folder=download_folder,
+        thread_limit=options['thread_count'],
         debug=options['debug'],
         auth=auth,
         tracker=tracker,
         duplicate_detector=duplicate_detector,
         skip_duplicates=options['skip_duplicates']
-    )
+    ):
+        if result['status'] == "completed":
+            downloaded_count += 1
+            progress_bar.update(downloaded_count)
+        elif result['status'] == "duplicate":
+            skipped_count += 1
     
     # Finish progress bar
     progress_bar.finish()
@@ -710,90 +424,6 @@ async def run_cli_scraper(options, username=None, api_key=None):
         zip_folder(download_folder, download_folder + ".zip")
         print(f"[DEBUG] Created {download_folder}.zip")
 
-async def start_scraper(query_tags, total_posts, thread_limit, download_folder, debug=False, auth=None, tracker=None, duplicate_detector=None, skip_duplicates=True):
-    os.makedirs(download_folder, exist_ok=True)
-    sem = asyncio.Semaphore(thread_limit)
-    downloaded = 0
-    skipped_duplicates = 0
-    page = 1
-
-    def update_progress():
-        nonlocal downloaded
-        downloaded += 1
-
-    async with aiohttp.ClientSession(auth=auth) as session:
-        while downloaded < total_posts:
-            batch = min(320, total_posts - downloaded)
-            params = {
-                "tags": query_tags,
-                "limit": str(batch),
-                "page": str(page)
-            }
-
-            if debug:
-                print(f"\n[DEBUG] GET posts.json → params={params!r}")
-
-            async with session.get(
-                    "https://e621.net/posts.json",
-                    params=params,
-                    headers=HEADERS
-            ) as resp:
-                if resp.status != 200:
-                    if debug:
-                        print(f"\n[DEBUG] HTTP {resp.status} — stopping")
-                    break
-                data = await resp.json()
-
-            posts = data.get("posts", [])
-            if not posts:
-                if debug:
-                    print(f"\n[DEBUG] No posts on page {page} — stopping")
-                break
-
-            # enqueue downloads
-            tasks = []
-            for post in posts:
-                file_url = post.get("file", {}).get("url") or post.get("sample", {}).get("url")
-                if file_url:
-                    tasks.append(download_file(
-                        sem, file_url, post["id"], session,
-                        download_folder, debug, auth, None,
-                        tracker, duplicate_detector, skip_duplicates,
-                        update_progress
-                    ))
-
-            if not tasks:
-                if debug:
-                    print(f"\n[DEBUG] No download URLs found on page {page} — stopping")
-                break
-
-            if debug:
-                print(f"\n[DEBUG] Page {page}: scheduling {len(tasks)} downloads")
-
-            results = await asyncio.gather(*tasks)
-
-            # Count skipped duplicates
-            for result in results:
-                if result == "duplicate":
-                    skipped_duplicates += 1
-
-            if debug:
-                print(f"\n[DEBUG] Total downloaded: {downloaded}, Skipped duplicates: {skipped_duplicates}")
-
-            # If fewer posts returned than requested, we've reached the end
-            if len(posts) < batch:
-                if debug:
-                    print(f"\n[DEBUG] Only {len(posts)} posts on page {page} (<{batch}) — done")
-                break
-
-            page += 1
-            await asyncio.sleep(1)  # respect rate limit
-
-        if debug:
-            print("\n[DEBUG] Scraping complete.")
-
-        return downloaded, skipped_duplicates
-
 def show_banner():
     print(f"{pystyle.Colors.reset}")
     """Display application banner"""
@@ -804,6 +434,7 @@ def show_banner():
 
 def main():
     """Main CLI function"""
+    os.system('cls' if os.name == 'nt' else 'clear')
     show_banner()
     
     try:
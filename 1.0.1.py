@@ -1,18 +1,31 @@
-import pystyle
-import asyncio
 import time
-import aiohttp
-import aiofiles
 import os
-from zipfile import ZipFile
 import sys
 import logging
-import requests
 import json
-import hashlib
-from threading import Lock
+import random
+import heapq
+import argparse
+import threading
 from datetime import datetime
-os.system('cls' if os.name == 'nt' else 'clear')
+
+from yiffscraper import (
+    BandwidthLimiter, CATALOG_FILE, check_credentials, ControlServer, credentials_from_env,
+    DownloadHistory, DownloadSlots, DownloadTracker, DuplicateDetector, export_links,
+    export_metadata, FairSlots, fetch_pool, fetch_posts_page, format_duration, format_size,
+    HistoryStats, ID_BATCH_SIZE, lazy_import, ListingError, page_file_names, parse_post_list,
+    parse_size, plan_download, PostCatalog, PostFilter, PROFILE_DIR, ProgressBar, RateLimiter,
+    run_profiled, sanitize_folder_name, scrape, SHARD_FILE, shard_query, ShardLeases,
+    SharedDownloads, start_event_log, start_scraper, stop_event_log, TagIndex, variant_post_files,
+    VariantPolicy, zip_folder,
+)
+
+# Heavy modules load on first use, so --help, history and catalog commands
+# start without paying for the network stack (see benchmarks/bench_startup.py)
+pystyle = lazy_import("pystyle")
+asyncio = lazy_import("asyncio")
+aiohttp = lazy_import("aiohttp")
+sqlite3 = lazy_import("sqlite3")
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,144 +34,95 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-HEADERS = {'User-Agent': 'Yiffscraper v4.1.0 CLI (by axo!)'}
-BASE_URL = "https://e621.net/posts.json?tags={}&limit={}"
-HISTORY_FILE = "download_history.json"
+CONFIG_FILE = "yiffscraper.json"
+KEYRING_SERVICE = "yiffscraper"
 
-class ProgressBar:
-    def __init__(self, total, width=50):
-        self.total = total
-        self.width = width
-        self.current = 0
-        self.start_time = time.time()
-        
-    def update(self, current):
-        self.current = current
-        percentage = (current / self.total) * 100 if self.total > 0 else 0
-        filled = int(self.width * current / self.total) if self.total > 0 else 0
-        bar = '█' * filled + '░' * (self.width - filled)
-        
-        elapsed = time.time() - self.start_time
-        if elapsed > 0 and current > 0:
-            speed = current / elapsed
-            eta = (self.total - current) / speed if speed > 0 else 0
-            eta_str = f"ETA: {int(eta)}s"
-        else:
-            eta_str = "ETA: --"
-            
-        print(f"\r[{bar}] {percentage:6.1f}% ({current}/{self.total}) {eta_str}", end='', flush=True)
-        
-    def finish(self):
-        self.update(self.total)
-        print()  
-
-class DownloadTracker:
-    def __init__(self):
-        self.downloaded_size = 0
-        self.total_estimated_size = 0
-        self.download_speed = 0
-        self.start_time = None
-        self.last_update_time = None
-        self.last_downloaded_size = 0
-        self.lock = Lock()
-        
-    def update_size(self, file_size):
-        with self.lock:
-            self.downloaded_size += file_size
-            current_time = time.time()
-            
-            if self.start_time is None:
-                self.start_time = current_time
-                self.last_update_time = current_time
-                
-            
-            if current_time - self.last_update_time >= 1.0:
-                time_diff = current_time - self.last_update_time
-                size_diff = self.downloaded_size - self.last_downloaded_size
-                self.download_speed = size_diff / time_diff
-                self.last_update_time = current_time
-                self.last_downloaded_size = self.downloaded_size
-    
-    def get_stats(self):
-        with self.lock:
-            downloaded_mb = self.downloaded_size / (1024 * 1024)
-            speed_mb = self.download_speed / (1024 * 1024)
-            return downloaded_mb, speed_mb
-
-class DownloadHistory:
-    def __init__(self, history_file=HISTORY_FILE):
-        self.history_file = history_file
-        self.history = self.load_history()
-
-    def load_history(self):
+def run_search(args):
+    catalog = PostCatalog(args.catalog)
+    try:
+        index = TagIndex(catalog)
+        if index.is_stale():
+            print("Updating tag index...")
+            build_started_at = time.perf_counter()
+            posts, tags = index.rebuild()
+            print(f"Indexed {posts} posts / {tags} tags in {time.perf_counter() - build_started_at:.2f}s")
+        search_started_at = time.perf_counter()
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"Error loading history: {e}")
-        return []
+            matches = index.search(args.tags)
+        except ValueError as e:
+            print(f"[ERROR] {e}")
+            return
+        elapsed = (time.perf_counter() - search_started_at) * 1000
+        print(f"{len(matches)} of {index.size} downloaded posts match '{args.tags}' ({elapsed:.1f} ms)")
 
-    def save_history(self):
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.history, f, indent=2)
-        except Exception as e:
-            print(f"Error saving history: {e}")
-
-    def add_entry(self, query_tags, count, total_size, duration, folder_name, skipped_duplicates=0):
-        entry = {
-            'timestamp': datetime.now().isoformat(),
-            'query_tags': query_tags,
-            'file_count': count,
-            'total_size_bytes': total_size,
-            'duration_seconds': duration,
-            'folder_name': folder_name,
-            'avg_speed_mbps': (total_size / (1024 * 1024)) / (duration / 60) if duration > 0 else 0,
-            'skipped_duplicates': skipped_duplicates
-        }
-        self.history.append(entry)
-        self.save_history()
-
-class DuplicateDetector:
-    def __init__(self, download_folder):
-        self.download_folder = download_folder
-        self.file_hashes = {}
-        self.load_existing_hashes()
-
-    def get_file_hash(self, filepath):
-        hash_md5 = hashlib.md5()
-        try:
-            with open(filepath, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        except Exception:
-            return None
+        if args.export:
+            linked, copied, missing = export_links(catalog, matches, args.export)
+            print(f"Exported to {args.export}: {linked} hardlinked, {copied} copied, {missing} missing on disk")
+        else:
+            for post_id in matches[:args.limit]:
+                post = catalog.get(post_id)
+                print(os.path.join(post['folder'], post['filename']))
+            if len(matches) > args.limit:
+                print(f"... {len(matches) - args.limit} more (use --limit or --export)")
+    finally:
+        catalog.close()
 
-    def get_data_hash(self, data):
-        return hashlib.md5(data).hexdigest()
+def run_catalog_command(args):
+    catalog = PostCatalog(args.catalog)
+    try:
+        if args.catalog_command == 'stats':
+            stats = catalog.stats()
+            print(f"Catalog: {args.catalog}")
+            print(f"Posts: {stats['posts']}")
+            print(f"Downloaded: {stats['downloaded']} ({format_size(stats['downloaded_bytes'])}) in {stats['folders']} folders")
+        elif args.catalog_command == 'sql':
+            try:
+                names, rows = catalog.query(args.sql)
+            except sqlite3.Error as e:
+                print(f"[ERROR] {e}")
+                return 1
+            if names:
+                print("\t".join(names))
+            for row in rows:
+                print("\t".join("" if value is None else str(value) for value in row))
+    finally:
+        catalog.close()
 
-    def load_existing_hashes(self):
-        if not os.path.exists(self.download_folder):
-            return
+def print_history_stats(top=15):
+    """Print throughput aggregates for the `history stats` command"""
+    stats = HistoryStats(DownloadHistory())
+    data = stats.refresh()
+    if not data['all']:
+        print("No download history yet.")
+        return
 
-        for filename in os.listdir(self.download_folder):
-            filepath = os.path.join(self.download_folder, filename)
-            if os.path.isfile(filepath):
-                file_hash = self.get_file_hash(filepath)
-                if file_hash:
-                    self.file_hashes[file_hash] = filename
+    def row(label, bucket):
+        rate = stats.throughput(bucket)
+        speed = f"{rate[0] / (1024 * 1024):.2f} MB/s" if rate else "--"
+        files = f"{rate[1]:.2f}" if rate else "--"
+        return f"{label[:40]:<42}{bucket['runs']:>6}{bucket['files']:>9}{format_size(bucket['bytes']):>12}{speed:>13}{files:>9}"
 
-    def is_duplicate(self, data, post_id):
-        data_hash = self.get_data_hash(data)
-        if data_hash in self.file_hashes:
-            return True, self.file_hashes[data_hash]
-        return False, None
+    header = f"{'':<42}{'runs':>6}{'files':>9}{'size':>12}{'speed':>13}{'files/s':>9}"
+    print("=== Download History ===")
+    print(header)
+    print(row("all runs", data['all']))
 
-    def add_hash(self, data, filename):
-        data_hash = self.get_data_hash(data)
-        self.file_hashes[data_hash] = filename
+    print("\n--- By query (most runs first) ---")
+    print(header)
+    queries = sorted(data['by_query'].items(), key=lambda item: item[1]['runs'], reverse=True)
+    for query, bucket in queries[:top]:
+        print(row(query or "(no tags)", bucket))
+
+    print("\n--- By hour of day ---")
+    print(header)
+    for hour, bucket in sorted(data['by_hour'].items(), key=lambda item: int(item[0])):
+        print(row(f"{int(hour):02d}:00", bucket))
+
+    if data['by_concurrency']:
+        print("\n--- By concurrency ---")
+        print(header)
+        for threads, bucket in sorted(data['by_concurrency'].items(), key=lambda item: int(item[0])):
+            print(row(f"{threads} threads", bucket))
 
 def safe_input_password(prompt):
     """
@@ -252,172 +216,695 @@ def safe_input_password(prompt):
     password = input("").strip()
     return password
 
-def sanitize_folder_name(name):
+def run_export(args):
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    start_time = time.time()
+
+    def show_progress(exported):
+        rate = exported / max(time.time() - start_time, 1e-6)
+        print(f"\rExported {exported} posts ({rate:.0f} posts/s)", end='', flush=True)
+
+    exported = asyncio.run(export_metadata(args.tags, args.output, args.format, args.count, auth, args.debug,
+                                           show_progress))
+    print(f"\nExported {exported} posts to {args.output} in {time.time() - start_time:.1f}s")
+
+async def run_post_list(post_ids, md5s, download_folder, thread_count=5, auth=None, skip_duplicates=True, debug=False):
+    """Download exactly the listed posts; returns (result counts by status, tracker)"""
+    counts = {'completed': 0, 'duplicate': 0, 'linked': 0, 'error': 0}
+    tracker = DownloadTracker()
+    label = f"post list ({len(post_ids) + len(md5s)})"
+    event_log = start_event_log()
+    catalog = PostCatalog()
+    try:
+        async for result in scrape(label, len(post_ids) + len(md5s), download_folder, thread_count, debug, auth,
+                                   tracker=tracker, duplicate_detector=DuplicateDetector(download_folder),
+                                   skip_duplicates=skip_duplicates, catalog=catalog,
+                                   post_ids=post_ids, md5s=md5s):
+            counts[result['status']] += 1
+    finally:
+        catalog.close()
+        stop_event_log(event_log)
+    return counts, tracker
+
+def run_fetch_command(args):
+    if args.source == '-':
+        text = sys.stdin.read()
+        name = "post_list"
+    else:
+        with open(args.source, 'r', encoding='utf-8') as f:
+            text = f.read()
+        name = sanitize_folder_name(os.path.splitext(os.path.basename(args.source))[0])
+    post_ids, md5s = parse_post_list(text)
+    if not post_ids and not md5s:
+        print(f"No post ids or md5s found in {args.source}")
+        return 2
+
+    folder_name = args.folder or name
+    download_folder = os.path.join("Folders", folder_name)
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    requests_needed = -(-len(post_ids) // ID_BATCH_SIZE) + -(-len(md5s) // ID_BATCH_SIZE)
+    print(f"Resolving {len(post_ids)} ids and {len(md5s)} md5s in {requests_needed} requests into {download_folder}")
+
+    start_time = time.time()
+    counts, tracker = asyncio.run(run_post_list(post_ids, md5s, download_folder, args.threads, auth,
+                                                args.skip_duplicates, args.debug))
+    duration = time.time() - start_time
+    found = sum(counts.values())
+    print(f"Downloaded: {counts['completed']} files ({format_size(tracker.downloaded_size)}) in {duration:.1f}s")
+    print(f"Already present: {counts['duplicate']}, failed: {counts['error']}, "
+          f"not found or unavailable: {len(post_ids) + len(md5s) - found}")
+    if counts['completed']:
+        DownloadHistory().add_entry(f"post list {name}", counts['completed'], tracker.downloaded_size, duration,
+                                    folder_name, counts['duplicate'], args.threads)
+    return 1 if counts['error'] else 0
+
+async def run_pool(pool_id, kind="pools", folder=None, thread_count=5, auth=None, debug=False):
+    """Download a pool or set under page-ordered names; returns (pool, folder name, counts, tracker)"""
+    counts = {'completed': 0, 'duplicate': 0, 'linked': 0, 'error': 0}
+    tracker = DownloadTracker()
+    async with aiohttp.ClientSession(auth=auth) as session:
+        pool = await fetch_pool(session, pool_id, kind, debug)
+        if not pool:
+            return None, None, counts, tracker
+        post_ids = pool.get('post_ids', [])
+        folder_name = folder or sanitize_folder_name(f"{pool.get('name') or pool_id}")
+        download_folder = os.path.join("Folders", folder_name)
+        print(f"{pool.get('name', pool_id)}: {len(post_ids)} pages -> {download_folder}")
+
+        event_log = start_event_log()
+        catalog = PostCatalog()
+        try:
+            async for result in scrape(f"{kind[:-1]}:{pool_id}", len(post_ids), download_folder, thread_count, debug,
+                                       auth, tracker=tracker, duplicate_detector=DuplicateDetector(download_folder),
+                                       catalog=catalog, session=session, post_ids=post_ids,
+                                       file_names=page_file_names(post_ids)):
+                counts[result['status']] += 1
+        finally:
+            catalog.close()
+            stop_event_log(event_log)
+    return pool, folder_name, counts, tracker
+
+def run_pool_command(args):
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    kind = "post_sets" if args.set else "pools"
+    start_time = time.time()
+    pool, folder_name, counts, tracker = asyncio.run(run_pool(args.id, kind, args.folder, args.threads, auth, args.debug))
+    if pool is None:
+        print(f"[ERROR] Could not fetch {kind[:-1]} {args.id}")
+        return 1
+    duration = time.time() - start_time
+    missing = len(pool.get('post_ids', [])) - sum(counts.values())
+    print(f"Downloaded: {counts['completed']} pages ({format_size(tracker.downloaded_size)}) in {duration:.1f}s")
+    print(f"Already present: {counts['duplicate']}, failed: {counts['error']}, unavailable: {missing}")
+    if counts['completed']:
+        DownloadHistory().add_entry(f"{kind[:-1]}:{args.id}", counts['completed'], tracker.downloaded_size,
+                                    duration, folder_name, counts['duplicate'], args.threads)
+    if args.zip:
+        download_folder = os.path.join("Folders", folder_name)
+        zip_folder(download_folder, download_folder + ".zip")
+        print(f"Created {download_folder}.zip")
+    return 1 if counts['error'] else 0
+
+async def run_upgrade(download_folder, posts, thread_count=5, auth=None, keep=False, debug=False):
+    """Download the originals of sampled posts; returns (result counts by status, upgraded posts, tracker)"""
+    counts = {'completed': 0, 'duplicate': 0, 'linked': 0, 'error': 0}
+    tracker = DownloadTracker()
+    # Keep the sample's name (e.g. a pool page number) for its original
+    file_names = {post_id: os.path.splitext(os.path.basename(paths[0]))[0] for post_id, paths in posts.items()}
+    upgraded = 0
+    event_log = start_event_log()
+    catalog = PostCatalog()
+    try:
+        async for result in scrape(f"upgrade:{download_folder}", len(posts), download_folder, thread_count, debug,
+                                   auth, tracker=tracker, duplicate_detector=DuplicateDetector(download_folder),
+                                   catalog=catalog, post_ids=list(posts), file_names=file_names):
+            counts[result['status']] += 1
+            if result['variant'] == 'original' and result['status'] != 'error':
+                upgraded += 1
+                if not keep:
+                    for path in posts.get(result['post_id'], []):
+                        os.remove(path)
+    finally:
+        catalog.close()
+        stop_event_log(event_log)
+    return counts, upgraded, tracker
+
+def run_upgrade_command(args):
+    download_folder = os.path.join("Folders", args.folder)
+    posts = variant_post_files(download_folder)
+    if not posts:
+        print(f"No samples or previews in {download_folder}")
+        return 0
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    print(f"Upgrading {len(posts)} posts in {download_folder} to their originals")
+
+    start_time = time.time()
+    counts, upgraded, tracker = asyncio.run(run_upgrade(download_folder, posts, args.threads, auth,
+                                                        args.keep, args.debug))
+    duration = time.time() - start_time
+    print(f"Upgraded: {upgraded} posts ({format_size(tracker.downloaded_size)} downloaded) in {duration:.1f}s")
+    print(f"Failed: {counts['error']}, not upgradable: {len(posts) - upgraded - counts['error']}")
+    if upgraded and not args.keep:
+        print("Replaced samples and previews were deleted")
+    return 1 if counts['error'] else 0
+
+SUBSCRIPTION_DEFAULTS = {
+    'interval': 3600,
+    'jitter': 0.1,
+    'count': 320,
+    'threads': 5,
+    'skip_duplicates': True,
+}
+
+def load_subscriptions(path):
     """
-    Sanitize folder name for iOS/mobile compatibility.
-    Removes problematic characters and handles leading dots.
+    Read a subscription file: either a list of tag strings / objects, or
+    {"defaults": {...}, "subscriptions": [...]}. Each subscription takes
+    tags, interval (seconds), jitter (fraction), count, threads, folder.
     """
-    
-    name = name.replace(" ", "_").replace(":", "-").replace("\\", "-").replace("/", "-").replace("*", "-").replace('"', "'").replace("|", "-").replace("<", "-").replace(">", "-").replace("?", "-")
-    
-    
-    if name.startswith("."):
-        name = "dot_" + name[1:]  
-    
-    
-    if not name:
-        name = "unnamed_folder"
-    
-    return name
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        defaults, entries = {}, data
+    else:
+        defaults, entries = data.get('defaults', {}), data.get('subscriptions', [])
 
-async def download_file(sem, file_url, post_id, session, download_folder, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True, progress_callback=None):
-    async with sem:
-        try:
-            if debug:
-                print(f"\n[DEBUG] Downloading post {post_id} from {file_url}")
+    subscriptions = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'tags': entry}
+        subscription = {**SUBSCRIPTION_DEFAULTS, **defaults, **entry}
+        if not subscription.get('tags', "").strip():
+            raise ValueError(f"Subscription without tags in {path}: {entry!r}")
+        subscription['folder'] = subscription.get('folder') or sanitize_folder_name(subscription['tags'])
+        subscriptions.append(subscription)
+    return subscriptions
 
-            async with session.get(file_url, headers=HEADERS, auth=auth, cookies=cookies) as response:
-                if response.status == 200:
-                    ext = file_url.split('.')[-1]
-                    fname = f"{post_id}.{ext}"
-                    path = os.path.join(download_folder, fname)
-                    data = await response.read()
+async def poll_subscription(subscription, session, rate_limiter, duplicate_detector, catalog, history, auth=None, debug=False, shared=None):
+    """One incremental fetch for a subscription; costs a single API call when nothing is new"""
+    download_folder = os.path.join("Folders", subscription['folder'])
+    tracker = DownloadTracker()
+    start_time = time.time()
+    downloaded, skipped = await start_scraper(
+        subscription['tags'], subscription['count'], subscription['threads'], download_folder,
+        debug=debug, auth=auth, tracker=tracker, duplicate_detector=duplicate_detector,
+        skip_duplicates=subscription['skip_duplicates'], catalog=catalog, sync=True,
+        session=session, rate_limiter=rate_limiter, shared=shared,
+    )
+    duration = time.time() - start_time
+    if downloaded:
+        history.add_entry(subscription['tags'], downloaded, tracker.downloaded_size, duration,
+                          subscription['folder'], skipped, subscription['threads'])
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {subscription['tags']}: {downloaded} new"
+          f"{f', {skipped} skipped' if skipped else ''} ({duration:.1f}s)")
+    return downloaded
 
-                    
-                    if duplicate_detector and skip_duplicates:
-                        is_dup, existing_file = duplicate_detector.is_duplicate(data, post_id)
-                        if is_dup:
-                            if debug:
-                                print(f"\n[DEBUG] Skipping duplicate {post_id} (matches {existing_file})")
-                            return "duplicate"
+async def run_daemon(subscriptions, auth=None, max_parallel=2, once=False, debug=False):
+    """
+    Poll every subscription on its own interval (with jitter) in one long-running
+    process. All polls share one HTTP session, one API rate limiter and one
+    catalog, each folder keeps its own duplicate index, and each poll is an
+    incremental sync. A post two running polls both list is downloaded once
+    and hardlinked into the other folder.
+    """
+    rate_limiter = RateLimiter()
+    catalog = PostCatalog()
+    history = DownloadHistory()
+    shared = SharedDownloads()
+    folders = [os.path.join("Folders", subscription['folder']) for subscription in subscriptions]
+    detectors = {folder: DuplicateDetector(folder) for folder in dict.fromkeys(folders)}
+    indexed = sum(len(detector.file_hashes) for detector in detectors.values())
+    print(f"Watching {len(subscriptions)} subscriptions ({indexed} files indexed)")
 
-                    
-                    file_size = len(data)
-                    if tracker:
-                        tracker.update_size(file_size)
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max_parallel)
+    wake = asyncio.Event()
+    running = set()
+    # Stagger the first round a little so the polls don't all start at once
+    schedule = [(loop.time() + random.uniform(0, 2) * index, index) for index in range(len(subscriptions))]
+    heapq.heapify(schedule)
 
-                    async with aiofiles.open(path, 'wb') as f:
-                        await f.write(data)
+    async def poll(index):
+        subscription = subscriptions[index]
+        async with slots:
+            poll_shared = shared.job()
+            try:
+                await poll_subscription(subscription, session, rate_limiter, detectors[folders[index]],
+                                        catalog, history, auth, debug, poll_shared)
+            except Exception as e:
+                logging.exception(f"Poll failed for {subscription['tags']!r}")
+                print(f"[ERROR] {subscription['tags']}: {e}")
+            finally:
+                poll_shared.close()
+        if not once:
+            jitter = subscription['jitter']
+            delay = subscription['interval'] * (1 + random.uniform(-jitter, jitter))
+            heapq.heappush(schedule, (loop.time() + delay, index))
+            wake.set()
 
-                    
-                    if duplicate_detector:
-                        duplicate_detector.add_hash(data, fname)
+    event_log = start_event_log()
+    try:
+        async with aiohttp.ClientSession(auth=auth) as session:
+            while schedule or running:
+                if not schedule:
+                    await asyncio.wait(running)
+                    continue
+                due, index = schedule[0]
+                delay = due - loop.time()
+                if delay > 0:
+                    wake.clear()
+                    try:
+                        await asyncio.wait_for(wake.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(schedule)
+                task = asyncio.create_task(poll(index))
+                running.add(task)
+                task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+        catalog.close()
+        stop_event_log(event_log)
 
-                    if debug:
-                        print(f"\n[DEBUG] Saved {fname} ({file_size} bytes)")
-                    
-                    if progress_callback:
-                        progress_callback()
-                        
-                    return "completed"
-                else:
-                    if debug:
-                        print(f"\n[DEBUG] HTTP {response.status} for post {post_id}")
-                    return "error"
+def run_daemon_command(args):
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    subscriptions = load_subscriptions(args.subscriptions)
+    if not subscriptions:
+        print(f"No subscriptions in {args.subscriptions}")
+        return
+    asyncio.run(run_daemon(subscriptions, auth, args.max_parallel, args.once, args.debug))
+
+def load_batch_queries(path, count=320):
+    """A subscription JSON file, or plain text with one query per line (# starts a comment)"""
+    if path.endswith('.json'):
+        return load_subscriptions(path)
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            tags = line.split('#', 1)[0].strip()
+            if tags:
+                queries.append({**SUBSCRIPTION_DEFAULTS, 'tags': tags, 'count': count,
+                                'folder': sanitize_folder_name(tags)})
+    return queries
+
+async def run_batch(queries, concurrency=10, max_parallel=4, auth=None, sync=False, debug=False, max_rate=None):
+    """
+    Run many queries in one process under a single download concurrency,
+    API rate budget and (optional) byte rate cap. A post listed by several
+    queries is downloaded once and hardlinked into every other query's folder.
+    """
+    rate_limiter = RateLimiter()
+    download_slots = asyncio.Semaphore(concurrency)
+    bandwidth = BandwidthLimiter(max_rate) if max_rate else None
+    query_slots = asyncio.Semaphore(max_parallel)
+    shared = SharedDownloads()
+    catalog = PostCatalog()
+    history = DownloadHistory()
+    results = []
+
+    async def run_query(query):
+        folder = os.path.join("Folders", query['folder'])
+        tracker = DownloadTracker()
+        async with query_slots:
+            start_time = time.time()
+            try:
+                downloaded, skipped = await start_scraper(
+                    query['tags'], query['count'], concurrency, folder,
+                    debug=debug, auth=auth, tracker=tracker,
+                    duplicate_detector=await asyncio.to_thread(DuplicateDetector, folder),
+                    skip_duplicates=query['skip_duplicates'], catalog=catalog, sync=sync,
+                    session=session, rate_limiter=rate_limiter,
+                    download_slots=download_slots, shared=shared, bandwidth=bandwidth,
+                )
+            except Exception as e:
+                logging.exception(f"Batch query failed: {query['tags']!r}")
+                print(f"[ERROR] {query['tags']}: {e}")
+                return
+            duration = time.time() - start_time
+        if downloaded:
+            history.add_entry(query['tags'], downloaded, tracker.downloaded_size, duration,
+                              query['folder'], skipped, concurrency)
+        results.append((query['tags'], downloaded, skipped, tracker.downloaded_size))
+        print(f"{query['tags']}: {downloaded} files"
+              f"{f', {skipped} skipped' if skipped else ''} ({format_size(tracker.downloaded_size)})")
+
+    event_log = start_event_log()
+    try:
+        connector = aiohttp.TCPConnector(limit=concurrency + max_parallel)
+        async with aiohttp.ClientSession(auth=auth, connector=connector) as session:
+            await asyncio.gather(*(run_query(query) for query in queries))
+    finally:
+        catalog.close()
+        stop_event_log(event_log)
+    return results, shared.linked
+
+def run_batch_command(args):
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    queries = load_batch_queries(args.queries, args.count)
+    if not queries:
+        print(f"No queries in {args.queries}")
+        return
+    print(f"Running {len(queries)} queries ({args.max_parallel} at a time, {args.concurrency} downloads)")
+    start_time = time.time()
+    max_rate = parse_size(args.max_rate) if args.max_rate else None
+    results, linked = asyncio.run(run_batch(queries, args.concurrency, args.max_parallel, auth, args.sync,
+                                            args.debug, max_rate))
+    files = sum(downloaded for _, downloaded, _, _ in results)
+    total_size = sum(size for _, _, _, size in results)
+    print(f"\nBatch done in {format_duration(time.time() - start_time)}: {files} files in "
+          f"{len(results)} folders, {files - linked} downloaded ({format_size(total_size)}), "
+          f"{linked} hardlinked from other queries")
+
+JOB_FINISHED = ("done", "failed", "cancelled")
+
+def new_job(job_id, request):
+    """A queued job from a submitted JSON body; raises ValueError on bad input"""
+    tags = str(request.get('tags') or "").strip()
+    if not tags:
+        raise ValueError("tags are required")
+    count = int(request.get('count', 320))
+    if count <= 0:
+        raise ValueError("count must be positive")
+    filters = request.get('filters') or []
+    if not isinstance(filters, list) or not all(isinstance(rule, str) for rule in filters):
+        raise ValueError("filters must be a list of rules, e.g. [\"score>=10\"]")
+    PostFilter(filters)
+    variant = request.get('variant') or "original"
+    VariantPolicy(variant)
+    return {
+        'id': job_id,
+        'tags': tags,
+        'count': count,
+        'folder': sanitize_folder_name(str(request.get('folder') or tags)),
+        'skip_duplicates': bool(request.get('skip_duplicates', True)),
+        'sync': bool(request.get('sync', False)),
+        'filters': filters,
+        'variant': variant,
+        'status': "queued",
+        'completed': 0,
+        'duplicate': 0,
+        'linked': 0,
+        'error': 0,
+        'bytes': 0,
+        'created': datetime.now().isoformat(),
+        'started': None,
+        'finished': None,
+        'message': None,
+    }
+
+async def run_server(port=8787, concurrency=10, auth=None, debug=False):
+    """
+    Serve scrape jobs over a local HTTP API until interrupted:
+
+        POST   /jobs              submit {"tags": ..., "count", "folder", "filters", "variant", "sync", ...}
+        GET    /jobs              list jobs
+        GET    /jobs/{id}         one job
+        GET    /jobs/{id}/events  progress as server-sent events until the job ends
+        DELETE /jobs/{id}         cancel a queued or running job
+
+    Jobs share one HTTP session, API rate limiter and catalog. A post one
+    running job fetches is hardlinked into the other jobs' folders, and each
+    folder is indexed for duplicates once, not per job. Every job starts
+    right away and download slots are handed out round-robin between them
+    (FairSlots), so a huge job can't starve small ones.
+    """
+    from aiohttp import web
+
+    rate_limiter = RateLimiter()
+    slots = FairSlots(concurrency)
+    shared = SharedDownloads()
+    catalog = PostCatalog()
+    history = DownloadHistory()
+    detectors = {}
+    index_lock = asyncio.Lock()
+    jobs = {}
+    tasks = {}
+    watchers = {}
+
+    async def folder_index(folder):
+        async with index_lock:
+            if folder not in detectors:
+                detectors[folder] = await asyncio.to_thread(DuplicateDetector, folder)
+            return detectors[folder]
+
+    def publish(job):
+        for queue in watchers.get(job['id'], ()):
+            queue.put_nowait(dict(job))
+
+    async def run_job(job):
+        folder = os.path.join("Folders", job['folder'])
+        tracker = DownloadTracker()
+        job_shared = shared.job()
+        start_time = time.time()
+        try:
+            duplicate_detector = await folder_index(folder)
+            job['status'] = "running"
+            job['started'] = datetime.now().isoformat()
+            publish(job)
+            start_time = time.time()
+            async for result in scrape(
+                    job['tags'], job['count'], folder, concurrency, debug, auth,
+                    tracker=tracker, duplicate_detector=duplicate_detector,
+                    skip_duplicates=job['skip_duplicates'], catalog=catalog, sync=job['sync'],
+                    session=session, rate_limiter=rate_limiter, download_slots=slots.job(job['id']),
+                    shared=job_shared, post_filter=PostFilter(job['filters']),
+                    variant_policy=VariantPolicy(job['variant'])):
+                job[result['status']] += 1
+                job['bytes'] = tracker.downloaded_size
+                publish(job)
+            job['status'] = "done"
+        except asyncio.CancelledError:
+            job['status'] = "cancelled"
         except Exception as e:
-            if debug:
-                print(f"\n[DEBUG] Exception {e}")
-            return "error"
+            logging.exception(f"Job {job['id']} failed: {job['tags']!r}")
+            job['status'] = "failed"
+            job['message'] = str(e)
+        finally:
+            job_shared.close()
+        job['finished'] = datetime.now().isoformat()
+        publish(job)
+        downloaded = job['completed'] + job['linked']
+        if downloaded:
+            history.add_entry(job['tags'], downloaded, tracker.downloaded_size, time.time() - start_time,
+                              job['folder'], job['duplicate'], concurrency)
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] job {job['id']} {job['status']}: {job['tags']} "
+              f"({downloaded} files, {format_size(job['bytes'])})")
 
-async def start_scraper(query_tags, total_images, thread_limit, download_folder, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True):
-    os.makedirs(download_folder, exist_ok=True)
-    sem = asyncio.Semaphore(thread_limit)
-    downloaded = 0
-    skipped_duplicates = 0
-    page = 1
-
-    def update_progress():
-        nonlocal downloaded
-        downloaded += 1
-
-    async with aiohttp.ClientSession(auth=auth, cookies=cookies) as session:
-        while downloaded < total_images:
-            batch = min(320, total_images - downloaded)
-            params = {
-                "tags": query_tags,
-                "limit": str(batch),
-                "page": str(page)
-            }
-
-            if debug:
-                print(f"\n[DEBUG] GET posts.json → params={params!r}")
-
-            async with session.get(
-                    "https://e621.net/posts.json",
-                    params=params,
-                    headers=HEADERS
-            ) as resp:
-                if resp.status != 200:
-                    if debug:
-                        print(f"\n[DEBUG] HTTP {resp.status} — stopping")
+    def find_job(request):
+        job = jobs.get(request.match_info['job_id'])
+        if job is None:
+            raise web.HTTPNotFound(text=json.dumps({'error': "no such job"}), content_type='application/json')
+        return job
+
+    async def submit(request):
+        try:
+            job = new_job(str(len(jobs) + 1), await request.json())
+        except (ValueError, TypeError, AttributeError) as e:
+            return web.json_response({'error': str(e) or "invalid job"}, status=400)
+        jobs[job['id']] = job
+        tasks[job['id']] = asyncio.create_task(run_job(job))
+        return web.json_response(job, status=201)
+
+    async def list_jobs(request):
+        return web.json_response(list(jobs.values()))
+
+    async def get_job(request):
+        return web.json_response(find_job(request))
+
+    async def cancel_job(request):
+        job = find_job(request)
+        if job['status'] in JOB_FINISHED:
+            return web.json_response({'error': f"job is already {job['status']}"}, status=409)
+        task = tasks[job['id']]
+        task.cancel()
+        await asyncio.wait([task])
+        return web.json_response(job)
+
+    async def job_events(request):
+        job = find_job(request)
+        response = web.StreamResponse(headers={'Content-Type': "text/event-stream", 'Cache-Control': "no-cache"})
+        await response.prepare(request)
+        queue = asyncio.Queue()
+        watchers.setdefault(job['id'], []).append(queue)
+        try:
+            snapshot = dict(job)
+            while True:
+                await response.write(f"data: {json.dumps(snapshot)}\n\n".encode())
+                if snapshot['status'] in JOB_FINISHED:
                     break
-                data = await resp.json()
+                snapshot = await queue.get()
+        finally:
+            watchers[job['id']].remove(queue)
+        return response
 
-            posts = data.get("posts", [])
-            if not posts:
-                if debug:
-                    print(f"\n[DEBUG] No posts on page {page} — stopping")
-                break
+    app = web.Application()
+    app.router.add_post('/jobs', submit)
+    app.router.add_get('/jobs', list_jobs)
+    app.router.add_get('/jobs/{job_id}', get_job)
+    app.router.add_delete('/jobs/{job_id}', cancel_job)
+    app.router.add_get('/jobs/{job_id}/events', job_events)
 
-            
-            tasks = []
-            for post in posts:
-                file_url = post.get("file", {}).get("url") or post.get("sample", {}).get("url")
-                if file_url:
-                    tasks.append(download_file(
-                        sem, file_url, post["id"], session,
-                        download_folder, debug, auth, cookies,
-                        tracker, duplicate_detector, skip_duplicates,
-                        update_progress
-                    ))
-
-            if not tasks:
-                if debug:
-                    print(f"\n[DEBUG] No download URLs found on page {page} — stopping")
-                break
-
-            if debug:
-                print(f"\n[DEBUG] Page {page}: scheduling {len(tasks)} downloads")
-
-            results = await asyncio.gather(*tasks)
+    event_log = start_event_log()
+    try:
+        # Downloads are capped by the slots and listings by the rate limiter
+        async with aiohttp.ClientSession(auth=auth) as session:
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            try:
+                await web.TCPSite(runner, "127.0.0.1", port).start()
+                print(f"Job server listening on http://127.0.0.1:{port}/jobs ({concurrency} downloads)")
+                await asyncio.Event().wait()
+            finally:
+                for task in tasks.values():
+                    task.cancel()
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+                await runner.cleanup()
+    finally:
+        catalog.close()
+        stop_event_log(event_log)
 
-            
-            for result in results:
-                if result == "duplicate":
-                    skipped_duplicates += 1
+def run_server_command(args):
+    username, api_key = resolve_credentials()
+    auth = aiohttp.BasicAuth(username, api_key) if username else None
+    asyncio.run(run_server(args.port, args.concurrency, auth, args.debug))
 
-            if debug:
-                print(f"\n[DEBUG] Total downloaded: {downloaded}, Skipped duplicates: {skipped_duplicates}")
+async def newest_post_id(query_tags, auth=None, debug=False):
+    """Id of the newest post matching a query, or None"""
+    async with aiohttp.ClientSession(auth=auth) as session:
+        posts = await fetch_posts_page(session, query_tags, 1, 1, debug)
+    return posts[0]['id'] if posts else None
 
-            
-            if len(posts) < batch:
-                if debug:
-                    print(f"\n[DEBUG] Only {len(posts)} posts on page {page} (<{batch}) — done")
-                break
-
-            page += 1
-            await asyncio.sleep(1)  
-
-        if debug:
-            print("\n[DEBUG] Scraping complete.")
-
-        return downloaded, skipped_duplicates
-
-def zip_folder(src_folder, dest_zip_file):
-    with ZipFile(dest_zip_file, 'w') as zipf:
-        for foldername, _, filenames in os.walk(src_folder):
-            for filename in filenames:
-                filepath = os.path.join(foldername, filename)
-                arcname = os.path.relpath(filepath, src_folder)
-                zipf.write(filepath, arcname)
-
-def format_size(bytes_size):
-    """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if bytes_size < 1024.0:
-            return f"{bytes_size:.1f} {unit}"
-        bytes_size /= 1024.0
-    return f"{bytes_size:.1f} TB"
+async def run_shard(leases, shard, query_tags, worker, session, download_folder, concurrency, auth,
+                    duplicate_detector, rate_limiter, ttl, debug=False):
+    """
+    Download one claimed shard while heartbeating its lease. Returns (result
+    counts, bytes, outcome): "done", "lost" when another worker took the
+    lease over, or "failed" when a listing page failed.
+    """
+    shard_id, low, high = shard
+    counts = {'completed': 0, 'duplicate': 0, 'linked': 0, 'error': 0}
+    tracker = DownloadTracker()
+
+    async def download():
+        async for result in scrape(shard_query(query_tags, low, high), high - low + 1, download_folder,
+                                   concurrency, debug, auth, tracker=tracker,
+                                   duplicate_detector=duplicate_detector, session=session,
+                                   rate_limiter=rate_limiter, strict_listing=True):
+            counts[result['status']] += 1
+
+    task = asyncio.create_task(download())
+    outcome = "done"
+    try:
+        while not task.done():
+            await asyncio.wait([task], timeout=ttl / 3)
+            if not task.done() and not await asyncio.to_thread(leases.heartbeat, shard_id, worker, ttl):
+                outcome = "lost"
+                task.cancel()
+        await task
+    except asyncio.CancelledError:
+        if outcome != "lost":
+            raise
+    except ListingError as e:
+        logging.warning(f"Shard {low}..{high}: {e}")
+        outcome = "failed"
+    finally:
+        task.cancel()
+    return counts, tracker.downloaded_size, outcome
+
+async def run_shard_worker(leases, query_tags, worker, download_folder, concurrency=8, auth=None, ttl=120,
+                           max_attempts=3, debug=False):
+    """
+    Claim and download shards of a query until every shard is finished. When
+    the remaining shards are all leased by other workers, wait for them to
+    complete or expire, so a crashed worker's shards still get done.
+    Returns (shards completed, files downloaded, bytes).
+    """
+    duplicate_detector = await asyncio.to_thread(DuplicateDetector, download_folder)
+    rate_limiter = RateLimiter()
+    shards_done = files = total_size = 0
+    event_log = start_event_log()
+    try:
+        connector = aiohttp.TCPConnector(limit=concurrency + 1)
+        async with aiohttp.ClientSession(auth=auth, connector=connector) as session:
+            while True:
+                shard = await asyncio.to_thread(leases.claim, query_tags, worker, ttl)
+                if shard is None:
+                    summary = await asyncio.to_thread(leases.summary, query_tags)
+                    if not summary.get('leased'):
+                        break
+                    await asyncio.sleep(min(ttl / 4, 5))
+                    continue
+
+                shard_id, low, high = shard
+                started = time.time()
+                counts, size, outcome = await run_shard(leases, shard, query_tags, worker, session,
+                                                        download_folder, concurrency, auth, duplicate_detector,
+                                                        rate_limiter, ttl, debug)
+                downloaded = counts['completed']
+                files += downloaded
+                total_size += size
+                if outcome == "done" and not counts['error']:
+                    if await asyncio.to_thread(leases.complete, shard_id, worker, downloaded, size):
+                        shards_done += 1
+                elif outcome != "lost":
+                    # Failed downloads or listing: another attempt re-lists and skips what is on disk
+                    await asyncio.to_thread(leases.release, shard_id, worker, downloaded, size, max_attempts)
+                print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {worker} shard {low}..{high}: {outcome}, "
+                      f"{downloaded} files ({format_size(size)}), {counts['duplicate']} skipped, "
+                      f"{counts['error']} failed in {time.time() - started:.1f}s")
+    finally:
+        stop_event_log(event_log)
+    return shards_done, files, total_size
+
+def print_shard_summary(leases, query_tags):
+    summary = leases.summary(query_tags)
+    if not summary:
+        print(f"No shards planned for {query_tags!r} in {leases.path}")
+        return
+    total = sum(row['shards'] for row in summary.values())
+    for status in ("done", "leased", "pending", "failed"):
+        row = summary.get(status)
+        if row:
+            print(f"{status:<8}{row['shards']:>6} / {total} shards  {row['downloaded']:>8} files  {format_size(row['bytes'])}")
+
+def run_shard_command(args):
+    leases = ShardLeases(args.db)
+    try:
+        if args.shard_command == 'plan':
+            username, api_key = resolve_credentials()
+            auth = aiohttp.BasicAuth(username, api_key) if username else None
+            max_id = args.max_id or asyncio.run(newest_post_id(args.tags, auth))
+            if not max_id:
+                print(f"[ERROR] No posts found for {args.tags!r}")
+                return 1
+            count = leases.plan(args.tags, max_id, args.size)
+            print(f"{args.tags!r}: {count} shards of up to {args.size} ids (1..{max_id}) in {args.db}")
+        elif args.shard_command == 'work':
+            import socket
+            worker = args.worker or f"{socket.gethostname()}-{os.getpid()}"
+            username, api_key = resolve_credentials()
+            auth = aiohttp.BasicAuth(username, api_key) if username else None
+            download_folder = os.path.join("Folders", args.folder or sanitize_folder_name(args.tags))
+            print(f"Worker {worker}: {args.tags!r} -> {download_folder}")
+            start_time = time.time()
+            shards, files, size = asyncio.run(run_shard_worker(leases, args.tags, worker, download_folder,
+                                                               args.threads, auth, args.ttl, debug=args.debug))
+            print(f"Worker {worker} finished {shards} shards: {files} files ({format_size(size)}) "
+                  f"in {format_duration(time.time() - start_time)}")
+            print_shard_summary(leases, args.tags)
+        elif args.shard_command == 'status':
+            print_shard_summary(leases, args.tags)
+    finally:
+        leases.close()
+    return 0
 
 def get_credentials():
     """Get login credentials from user"""
@@ -445,16 +932,14 @@ def get_credentials():
             
         
         print("[DEBUG] Testing credentials...")
-        test_url = "https://e621.net/posts.json?tags=rating:safe&limit=1"
-        auth = (username, api_key)
-        r = requests.get(test_url, auth=auth, headers=HEADERS)
+        status = asyncio.run(check_credentials(username, api_key))
         
-        if r.status_code == 200:
+        if status == 200:
             print(f"[DEBUG] Successfully logged in as '{username}'")
             time.sleep(1)
             return username, api_key
         else:
-            print(f"[DEBUG] Authentication failed (HTTP {r.status_code})")
+            print(f"[DEBUG] Authentication failed (HTTP {status})")
             time.sleep(1)
             return None, None
     else:
@@ -534,33 +1019,49 @@ def get_download_options():
         'debug': debug
     }
 
-def estimate_total_size(query_tags, post_count, auth=None):
-    """Estimate total download size by sampling posts"""
-    try:
-        url = f"https://e621.net/posts.json?tags={query_tags}&limit=10"
-        r = requests.get(url, auth=auth, headers=HEADERS)
-        
-        if r.status_code == 200:
-            data = r.json()
-            posts = data.get('posts', [])
-            if posts:
-                total_sample_size = 0
-                valid_posts = 0
-                
-                for post in posts:
-                    file_info = post.get('file', {})
-                    if file_info.get('size'):
-                        total_sample_size += file_info['size']
-                        valid_posts += 1
-                
-                if valid_posts > 0:
-                    avg_size = total_sample_size / valid_posts
-                    estimated_total = avg_size * post_count
-                    return estimated_total
-    except Exception as e:
-        print(f"Error estimating size: {e}")
-    
-    return 0
+async def run_plan(options, username=None, api_key=None):
+    """Print what a run with these options would download, without downloading"""
+    download_folder = os.path.join("Folders", options['folder_name'])
+    auth = aiohttp.BasicAuth(username, api_key) if username and api_key else None
+
+    print("\n=== Download Plan ===")
+    print(f"Tags: {options['tags']}")
+    print(f"Folder: {download_folder}")
+    post_filter = PostFilter(options.get('filters', ()))
+    variant_policy = VariantPolicy(options.get('variant') or "original")
+    since_id = None
+    if options.get('sync'):
+        catalog = PostCatalog()
+        try:
+            since_id = catalog.get_sync_id(options['tags'])
+        finally:
+            catalog.close()
+        print(f"Mode: sync (posts after id {since_id})" if since_id else "Mode: sync (first run, full listing)")
+    plan = await plan_download(options['tags'], options['post_count'], download_folder, auth, options['debug'],
+                               post_filter, variant_policy, since_id)
+
+    print(f"Listed posts: {plan['listed']} ({plan['pages']} pages)")
+    if plan['unavailable']:
+        print(f"Without a file URL (deleted or login required): {plan['unavailable']}")
+    if post_filter:
+        print(f"Dropped by filters: {plan['filtered']} files ({format_size(plan['filtered_bytes'])})")
+    print(f"Already downloaded: {plan['local_files']} files ({format_size(plan['local_bytes'])})")
+    print(f"To download: {plan['files']} files ({format_size(plan['bytes'])})")
+    if plan['unknown_size']:
+        print(f"  {plan['unknown_size']} of them have no size in the listing")
+    if plan['estimated_size']:
+        print(f"  {plan['estimated_size']} sample/preview sizes are estimated from their pixel count")
+    if plan['files'] < options['post_count']:
+        print(f"The query only has {plan['files']} new files, fewer than the {options['post_count']} requested")
+
+    prediction = HistoryStats(DownloadHistory()).predict(
+        options['tags'], plan['files'], options['thread_count'], total_bytes=plan['bytes'])
+    if prediction and plan['files']:
+        print(f"Predicted duration: {format_duration(prediction['seconds'])} "
+              f"(from {prediction['runs']} past runs, by {prediction['basis']})")
+    elif plan['files']:
+        print("Predicted duration: unknown (no download history yet)")
+    return plan
 
 async def run_cli_scraper(options, username=None, api_key=None):
     """Main scraper function for CLI"""
@@ -573,7 +1074,12 @@ async def run_cli_scraper(options, username=None, api_key=None):
         auth = aiohttp.BasicAuth(username, api_key)
     
     
-    tracker = DownloadTracker()
+    control_port = options.get('control_port')
+    # A control endpoint can set a cap later, so it always gets a limiter
+    bandwidth = None
+    if options.get('max_rate') or control_port is not None:
+        bandwidth = BandwidthLimiter(options.get('max_rate'))
+    tracker = DownloadTracker(bandwidth)
     duplicate_detector = DuplicateDetector(download_folder)
     progress_bar = ProgressBar(options['post_count'])
     history = DownloadHistory()
@@ -584,15 +1090,32 @@ async def run_cli_scraper(options, username=None, api_key=None):
     print(f"Threads: {options['thread_count']}")
     print(f"Folder: {download_folder}")
     print(f"Skip duplicates: {options['skip_duplicates']}")
+    if options.get('sync'):
+        print("Mode: sync (new posts only)")
+    post_filter = PostFilter(options.get('filters', ()))
+    if post_filter:
+        print(f"Filters: {' '.join(options['filters'])}")
+    variant_policy = VariantPolicy(options.get('variant', "original"))
+    if variant_policy.variant != 'original':
+        print(f"Variant: {variant_policy.policy}")
+    if bandwidth and bandwidth.rate:
+        print(f"Bandwidth cap: {format_size(bandwidth.rate)}/s")
+    download_slots = None
+    control = None
+    if control_port is not None:
+        download_slots = DownloadSlots(options['thread_count'])
+        control = ControlServer(download_slots, tracker, bandwidth, port=control_port)
+        await control.start()
+        print(f"Control endpoint: http://127.0.0.1:{control.port}/state")
     
     
-    if auth:
-        estimated_size = estimate_total_size(options['tags'], options['post_count'], (username, api_key))
-    else:
-        estimated_size = estimate_total_size(options['tags'], options['post_count'])
-    
-    if estimated_size > 0:
-        print(f"Estimated download size: {format_size(estimated_size)}")
+    prediction = HistoryStats(history).predict(options['tags'], options['post_count'], options['thread_count'])
+    if prediction:
+        tracker.total_estimated_size = prediction['bytes']
+        print(f"Estimated duration: {format_duration(prediction['seconds'])} "
+              f"(from {prediction['runs']} past runs, by {prediction['basis']})")
+        if prediction['bytes'] > 0:
+            print(f"Estimated download size: {format_size(prediction['bytes'])}")
     
     print()  
     
@@ -604,25 +1127,49 @@ async def run_cli_scraper(options, username=None, api_key=None):
         while progress_bar.current < progress_bar.total:
             downloaded_mb, speed_mb = tracker.get_stats()
             if downloaded_mb > 0:
-                print(f"\nDownloaded: {format_size(tracker.downloaded_size)} | Speed: {speed_mb:.1f} MB/s")
+                estimate = f" of ~{format_size(tracker.total_estimated_size)}" if tracker.total_estimated_size else ""
+                utilization = tracker.get_utilization()
+                cap = (f" ({utilization[0] / utilization[1] * 100:.0f}% of the {format_size(utilization[1])}/s cap)"
+                       if utilization else "")
+                print(f"\nDownloaded: {format_size(tracker.downloaded_size)}{estimate} | Speed: {speed_mb:.1f} MB/s{cap}")
             time.sleep(2)
     
-    import threading
     progress_thread = threading.Thread(target=progress_reporter, daemon=True)
     progress_thread.start()
     
     
-    downloaded_count, skipped_count = await start_scraper(
-        query_tags=options['tags'],
-        total_images=options['post_count'],
-        thread_limit=options['thread_count'],
-        download_folder=download_folder,
-        debug=options['debug'],
-        auth=auth,
-        tracker=tracker,
-        duplicate_detector=duplicate_detector,
-        skip_duplicates=options['skip_duplicates']
-    )
+    downloaded_count = 0
+    skipped_count = 0
+    event_log = start_event_log()
+    catalog = PostCatalog()
+    try:
+        async for result in scrape(
+            query_tags=options['tags'],
+            total_images=options['post_count'],
+            download_folder=download_folder,
+            thread_limit=options['thread_count'],
+            debug=options['debug'],
+            auth=auth,
+            tracker=tracker,
+            duplicate_detector=duplicate_detector,
+            skip_duplicates=options['skip_duplicates'],
+            catalog=catalog,
+            sync=options.get('sync', False),
+            post_filter=post_filter,
+            variant_policy=variant_policy,
+            bandwidth=bandwidth,
+            download_slots=download_slots
+        ):
+            if result['status'] == "completed":
+                downloaded_count += 1
+                progress_bar.update(downloaded_count)
+            elif result['status'] == "duplicate":
+                skipped_count += 1
+    finally:
+        if control:
+            await control.stop()
+        catalog.close()
+        stop_event_log(event_log)
     
     
     progress_bar.finish()
@@ -639,6 +1186,11 @@ async def run_cli_scraper(options, username=None, api_key=None):
     print(f"=== Download Complete ===")
     print(f"Downloaded: {downloaded_count} files")
     print(f"Skipped duplicates: {skipped_count}")
+    if post_filter:
+        filtered_posts, filtered_bytes = post_filter.totals()
+        print(f"Filtered out: {filtered_posts} posts ({format_size(filtered_bytes)} not downloaded)")
+        for rule, stats in post_filter.stats.items():
+            print(f"  {rule}: {stats['posts']} posts, {format_size(stats['bytes'])}")
     print(f"Total size: {format_size(final_size)}")
     print(f"Duration: {duration:.1f} seconds")
     print(f"Average speed: {(final_size / (1024 * 1024)) / (duration / 60):.1f} MB/min")
@@ -650,7 +1202,8 @@ async def run_cli_scraper(options, username=None, api_key=None):
         total_size=final_size,
         duration=duration,
         folder_name=options['folder_name'],
-        skipped_duplicates=skipped_count
+        skipped_duplicates=skipped_count,
+        thread_count=options['thread_count']
     )
     
     
@@ -659,6 +1212,131 @@ async def run_cli_scraper(options, username=None, api_key=None):
         zip_folder(download_folder, download_folder + ".zip")
         print(f"[DEBUG] Created {download_folder}.zip")
 
+RUN_DEFAULTS = {
+    'count': 320,
+    'threads': 5,
+    'zip': False,
+    'skip_duplicates': True,
+    'sync': False,
+    'variant': "original",
+    'debug': False,
+}
+
+def load_config(path=CONFIG_FILE, profile=None):
+    """
+    Settings from a JSON config file: "defaults" apply to every run and
+    "profiles" holds named sets of options (tags, count, threads, folder,
+    zip, skip_duplicates, sync, filters, variant, max_rate, control_port,
+    username) picked with --use.
+    """
+    if not os.path.exists(path):
+        if profile:
+            raise ValueError(f"Config file {path} not found")
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    settings = dict(config.get('defaults', {}))
+    if profile:
+        profiles = config.get('profiles', {})
+        if profile not in profiles:
+            raise ValueError(f"No profile '{profile}' in {path} (have: {', '.join(sorted(profiles)) or 'none'})")
+        settings.update(profiles[profile])
+    filters = settings.get('filters')
+    if filters is not None and not (isinstance(filters, list) and all(isinstance(rule, str) for rule in filters)):
+        raise ValueError(f"\"filters\" in {path} must be a list of rules, e.g. [\"score>=10\"]")
+    return settings
+
+def resolve_credentials(username=None):
+    """
+    Credentials without prompting: E621_USERNAME / E621_API_KEY first, then
+    the API key stored in the system keyring (if the keyring package is
+    installed) for E621_USERNAME or the configured username.
+    """
+    env_username, api_key = credentials_from_env()
+    if env_username:
+        return env_username, api_key
+    username = os.environ.get("E621_USERNAME") or username
+    if not username:
+        return None, None
+    try:
+        import keyring
+        api_key = keyring.get_password(KEYRING_SERVICE, username)
+    except Exception:
+        api_key = None
+    return (username, api_key) if api_key else (None, None)
+
+def options_from_args(args):
+    """Build run options from config defaults < config profile < command line; also returns the username"""
+    settings = {**RUN_DEFAULTS, **load_config(args.config, args.use)}
+    overrides = {
+        'tags': args.tags,
+        'count': args.count,
+        'threads': args.threads,
+        'folder': args.folder,
+        'zip': args.zip,
+        'skip_duplicates': args.skip_duplicates,
+        'sync': args.sync or None,
+        'variant': args.variant,
+        'max_rate': args.max_rate,
+        'control_port': args.control,
+        'debug': args.debug,
+    }
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+
+    tags = (settings.get('tags') or "").strip()
+    if not tags:
+        raise ValueError("No tags given (pass them as an argument or set \"tags\" in the config profile)")
+    if settings['count'] <= 0 or settings['threads'] <= 0:
+        raise ValueError("count and threads must be positive")
+    # Filter rules from the command line add to the configured ones
+    filters = list(settings.get('filters') or []) + list(args.filter or [])
+    PostFilter(filters)
+    VariantPolicy(settings['variant'])
+    max_rate = parse_size(settings['max_rate']) if settings.get('max_rate') else None
+    options = {
+        'tags': tags,
+        'post_count': settings['count'],
+        'thread_count': settings['threads'],
+        'folder_name': settings.get('folder') or sanitize_folder_name(tags),
+        'zip_folder': settings['zip'],
+        'skip_duplicates': settings['skip_duplicates'],
+        'debug': settings['debug'],
+        'sync': settings['sync'],
+        'filters': filters,
+        'variant': settings['variant'],
+        'max_rate': max_rate,
+        'control_port': settings.get('control_port'),
+    }
+    return options, settings.get('username')
+
+def run_unattended(args):
+    """Non-interactive download: no prompts, no screen clearing, no credential probe; returns an exit code"""
+    try:
+        options, username = options_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return 2
+    username, api_key = resolve_credentials(username)
+    try:
+        if args.plan:
+            asyncio.run(run_plan(options, username, api_key))
+        elif args.profile:
+            run_profiled(run_cli_scraper(options, username, api_key), args.profile_dir, print_profile_report)
+        else:
+            asyncio.run(run_cli_scraper(options, username, api_key))
+    except KeyboardInterrupt:
+        print("\n\nDownload interrupted by user.")
+        return 130
+    except Exception as e:
+        print(f"\nError: {e}")
+        logging.exception("Unattended run failed")
+        return 1
+    return 0
+
+def print_profile_report(report, collapsed):
+    print(f"\n[PROFILE] Report: {report}")
+    print(f"[PROFILE] Collapsed stacks: {collapsed}")
+
 def show_banner():
     print(f"{pystyle.Colors.reset}")
     """Display application banner"""
@@ -667,8 +1345,175 @@ def show_banner():
     print(" Made by DD87686 on github <3 ")
     print("==============================")
 
+def run_mode_parser(top_level=True):
+    """--profile, --plan and --sync, accepted before any subcommand and after `run`"""
+    parser = argparse.ArgumentParser(add_help=False)
+    # Under `run` they default to SUPPRESS, so the same flags given before the subcommand are kept
+    unset = {} if top_level else {'default': argparse.SUPPRESS}
+    parser.add_argument('--profile', action='store_true', **unset,
+                        help="profile the run and write a report to --profile-dir")
+    parser.add_argument('--profile-dir', default=PROFILE_DIR if top_level else argparse.SUPPRESS,
+                        help=f"where profile reports are written (default: {PROFILE_DIR})")
+    parser.add_argument('--plan', action='store_true', **unset,
+                        help="dry run: list the query and report what would be downloaded")
+    parser.add_argument('--sync', action='store_true', **unset,
+                        help="only fetch posts newer than the last successful sync of the same tags")
+    return parser
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="YiffScraper CLI", parents=[run_mode_parser()])
+    commands = parser.add_subparsers(dest='command')
+
+    history_parser = commands.add_parser('history', help="inspect the download history")
+    history_commands = history_parser.add_subparsers(dest='history_command', required=True)
+    stats_parser = history_commands.add_parser('stats', help="throughput by query, time of day and concurrency")
+    stats_parser.add_argument('--top', type=int, default=15, help="number of queries to list")
+
+    export_parser = commands.add_parser('export', help="export post metadata only (no media) to JSONL or SQLite")
+    export_parser.add_argument('tags', help="tag query, e.g. \"wolf rating:s\"")
+    export_parser.add_argument('-o', '--output', required=True, help="output .jsonl or .db file")
+    export_parser.add_argument('--format', choices=['jsonl', 'sqlite'], default=None,
+                               help="default: guessed from the output extension")
+    export_parser.add_argument('-n', '--count', type=int, default=0, help="stop after this many posts (0 = all)")
+    export_parser.add_argument('--debug', action='store_true')
+
+    catalog_parser = commands.add_parser('catalog', help="query the local post catalog")
+    catalog_parser.add_argument('--catalog', default=CATALOG_FILE, help=f"catalog file (default: {CATALOG_FILE})")
+    catalog_commands = catalog_parser.add_subparsers(dest='catalog_command', required=True)
+    catalog_commands.add_parser('stats', help="post and download counts")
+    sql_parser = catalog_commands.add_parser('sql', help="run a SQL query against the posts table")
+    sql_parser.add_argument('sql')
+
+    search_parser = commands.add_parser('search', help="offline tag search over downloaded posts")
+    search_parser.add_argument('tags', help="e.g. \"wolf -cat ~fox ~dog rating:s\"")
+    search_parser.add_argument('--export', metavar='FOLDER', help="hardlink the matching files into FOLDER")
+    search_parser.add_argument('--limit', type=int, default=20, help="paths to print (default 20)")
+    search_parser.add_argument('--catalog', default=CATALOG_FILE, help=f"catalog file (default: {CATALOG_FILE})")
+
+    run_parser = commands.add_parser('run', help="download without any prompts (for scripts and schedulers)",
+                                     parents=[run_mode_parser(top_level=False)])
+    run_parser.add_argument('tags', nargs='?', help="tag query (default: from the config profile)")
+    run_parser.add_argument('-n', '--count', type=int, help=f"posts to download (default {RUN_DEFAULTS['count']})")
+    run_parser.add_argument('-c', '--threads', type=int, help=f"parallel downloads (default {RUN_DEFAULTS['threads']})")
+    run_parser.add_argument('-o', '--folder', help="output folder under Folders/ (default: from the tags)")
+    run_parser.add_argument('--zip', action='store_true', default=None, help="zip the folder afterwards")
+    run_parser.add_argument('--no-dedup', dest='skip_duplicates', action='store_false', default=None,
+                            help="download files even if their md5 is already in the folder")
+    run_parser.add_argument('-f', '--filter', action='append', metavar='RULE',
+                            help="skip posts before downloading, e.g. size<20MB, ext!=webm, score>=50, "
+                                 "rating=s, width>=1920, tags!=comic,sketch (repeatable)")
+    run_parser.add_argument('--variant', metavar='POLICY',
+                            help="original (default), sample, preview or sample>SIZE (sample only for bigger originals)")
+    run_parser.add_argument('--max-rate', metavar='RATE', help="download byte rate cap, e.g. 40MB (per second)")
+    run_parser.add_argument('--control', type=int, metavar='PORT',
+                            help="serve a localhost control endpoint (pause, resume, concurrency, bandwidth, "
+                                 "state) on this port; 0 picks a free one")
+    run_parser.add_argument('--debug', action='store_true', default=None)
+    run_parser.add_argument('--config', default=CONFIG_FILE, help=f"JSON config file (default: {CONFIG_FILE})")
+    run_parser.add_argument('-u', '--use', metavar='PROFILE', help="named profile from the config file")
+
+    fetch_parser = commands.add_parser('fetch', help="download a list of post ids / md5s (file or stdin)")
+    fetch_parser.add_argument('source', nargs='?', default='-',
+                              help="file with ids, md5s or post URLs; '-' or nothing reads stdin")
+    fetch_parser.add_argument('-o', '--folder', help="output folder under Folders/ (default: from the file name)")
+    fetch_parser.add_argument('-c', '--threads', type=int, default=5, help="parallel downloads")
+    fetch_parser.add_argument('--no-dedup', dest='skip_duplicates', action='store_false',
+                              help="download files even if their md5 is already in the folder")
+    fetch_parser.add_argument('--debug', action='store_true')
+
+    upgrade_parser = commands.add_parser('upgrade', help="replace the samples/previews in a folder with originals")
+    upgrade_parser.add_argument('folder', help="folder under Folders/")
+    upgrade_parser.add_argument('-c', '--threads', type=int, default=5, help="parallel downloads")
+    upgrade_parser.add_argument('--keep', action='store_true', help="keep the samples and previews")
+    upgrade_parser.add_argument('--debug', action='store_true')
+
+    pool_parser = commands.add_parser('pool', help="download a pool (comic) or set with page-ordered file names")
+    pool_parser.add_argument('id', type=int, help="pool id (or set id with --set)")
+    pool_parser.add_argument('--set', action='store_true', help="the id is a post set, not a pool")
+    pool_parser.add_argument('-o', '--folder', help="output folder under Folders/ (default: the pool name)")
+    pool_parser.add_argument('-c', '--threads', type=int, default=5, help="parallel downloads")
+    pool_parser.add_argument('--zip', action='store_true', help="zip the folder afterwards")
+    pool_parser.add_argument('--debug', action='store_true')
+
+    batch_parser = commands.add_parser('batch', help="run many queries at once, downloading shared posts once")
+    batch_parser.add_argument('queries', help="text file with one query per line, or a subscription JSON file")
+    batch_parser.add_argument('-n', '--count', type=int, default=320, help="posts per query (text files)")
+    batch_parser.add_argument('-c', '--concurrency', type=int, default=10, help="downloads in flight across all queries")
+    batch_parser.add_argument('--max-parallel', type=int, default=4, help="queries listed at the same time")
+    batch_parser.add_argument('--sync', action='store_true', help="only fetch posts newer than each query's last run")
+    batch_parser.add_argument('--max-rate', metavar='RATE', help="download byte rate cap across all queries, e.g. 40MB")
+    batch_parser.add_argument('--debug', action='store_true')
+
+    shard_parser = commands.add_parser('shard', help="split a query into id ranges and download them on several machines")
+    shard_parser.add_argument('--db', default=SHARD_FILE, help=f"lease table, may be on shared storage (default: {SHARD_FILE})")
+    shard_commands = shard_parser.add_subparsers(dest='shard_command', required=True)
+    shard_plan_parser = shard_commands.add_parser('plan', help="create the shards of a query (again: retry failed ones)")
+    shard_plan_parser.add_argument('tags')
+    shard_plan_parser.add_argument('--size', type=int, default=20000, help="post ids per shard")
+    shard_plan_parser.add_argument('--max-id', type=int, help="highest post id (default: the query's newest post)")
+    shard_work_parser = shard_commands.add_parser('work', help="claim and download shards until all are done")
+    shard_work_parser.add_argument('tags')
+    shard_work_parser.add_argument('-o', '--folder', help="output folder under Folders/ (default: from the tags)")
+    shard_work_parser.add_argument('-c', '--threads', type=int, default=8, help="parallel downloads")
+    shard_work_parser.add_argument('--worker', help="worker name in the lease table (default: host-pid)")
+    shard_work_parser.add_argument('--ttl', type=float, default=120, help="lease length in seconds")
+    shard_work_parser.add_argument('--debug', action='store_true')
+    shard_status_parser = shard_commands.add_parser('status', help="shard progress of a query")
+    shard_status_parser.add_argument('tags')
+
+    serve_parser = commands.add_parser('serve', help="run a local HTTP job server (submit, list, follow, cancel)")
+    serve_parser.add_argument('--port', type=int, default=8787)
+    serve_parser.add_argument('-c', '--concurrency', type=int, default=10, help="downloads in flight across all jobs")
+    serve_parser.add_argument('--debug', action='store_true')
+
+    daemon_parser = commands.add_parser('daemon', help="keep polling saved queries (subscriptions)")
+    daemon_parser.add_argument('subscriptions', help="subscription JSON file")
+    daemon_parser.add_argument('--max-parallel', type=int, default=2, help="subscriptions polled at the same time")
+    daemon_parser.add_argument('--once', action='store_true', help="poll every subscription once, then exit")
+    daemon_parser.add_argument('--debug', action='store_true')
+    return parser.parse_args(argv)
+
 def main():
     """Main CLI function"""
+    args = parse_args()
+    if args.command == 'history':
+        print_history_stats(args.top)
+        return
+    if args.command == 'export':
+        run_export(args)
+        return
+    if args.command == 'catalog':
+        return run_catalog_command(args)
+    if args.command == 'search':
+        run_search(args)
+        return
+    if args.command == 'run':
+        return run_unattended(args)
+    if args.command == 'fetch':
+        return run_fetch_command(args)
+    if args.command == 'upgrade':
+        return run_upgrade_command(args)
+    if args.command == 'pool':
+        return run_pool_command(args)
+    if args.command == 'batch':
+        run_batch_command(args)
+        return
+    if args.command == 'daemon':
+        try:
+            run_daemon_command(args)
+        except KeyboardInterrupt:
+            print("\nDaemon stopped.")
+        return
+    if args.command == 'shard':
+        return run_shard_command(args)
+    if args.command == 'serve':
+        try:
+            run_server_command(args)
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+        return
+
+    os.system('cls' if os.name == 'nt' else 'clear')
     show_banner()
     
     options = None  
@@ -682,9 +1527,15 @@ def main():
         if not options:
             print("Invalid options provided. Exiting.")
             return
+        options['sync'] = args.sync
         
         
-        asyncio.run(run_cli_scraper(options, username, api_key))
+        if args.plan:
+            asyncio.run(run_plan(options, username, api_key))
+        elif args.profile:
+            run_profiled(run_cli_scraper(options, username, api_key), args.profile_dir, print_profile_report)
+        else:
+            asyncio.run(run_cli_scraper(options, username, api_key))
         
     except KeyboardInterrupt:
         print("\n\nDownload interrupted by user.")
@@ -695,4 +1546,4 @@ def main():
             traceback.print_exc()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,12 @@
+"""Import the scraping engine (yiffscraper.py) so the benchmarks can drive it in-process"""
+import importlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_scraper():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module("yiffscraper")
@@ -0,0 +1,166 @@
+"""
+Degraded-mode benchmark: runs start_scraper against the mock server under each
+fault profile and reports how many posts were lost and how much goodput
+(verified bytes per second) was left.
+
+"lost" counts posts whose file was requested at least once but never ended up
+on disk intact; "shortfall" is how far the run fell short of the requested
+post count (a failed listing page ends the run early).
+
+Saved files are checked against the md5 the mock server advertises, so
+truncated bodies that were written to disk count as lost, not as downloaded.
+
+    python benchmarks/bench_chaos.py
+    python benchmarks/bench_chaos.py --profiles rate_limit,reset --posts 500 --fault-rate 0.1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+
+sys.path.insert(0, HERE)
+from bench_throughput import start_mock_server, stop_mock_server, write_json  # noqa: E402
+from mock_e621 import FAULT_PROFILES, SyntheticPosts  # noqa: E402
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run_case(case):
+    """Child-process side: one scrape under one fault profile, then verify"""
+    from _scraper import load_scraper
+    scraper = load_scraper()
+    scraper.API_BASE = case['api_base']
+    scraper.PAGE_DELAY = 0
+    posts = SyntheticPosts(case['server_posts'], case['sizes'], case['size_scale'])
+
+    folder = tempfile.mkdtemp(prefix="ys-chaos-")
+    try:
+        wall_start = time.perf_counter()
+        downloaded, skipped = asyncio.run(asyncio.wait_for(scraper.start_scraper(
+            query_tags="",
+            total_images=case['posts'],
+            thread_limit=case['concurrency'],
+            download_folder=folder,
+            tracker=scraper.DownloadTracker(),
+            duplicate_detector=scraper.DuplicateDetector(folder),
+        ), case['timeout']))
+        wall = time.perf_counter() - wall_start
+
+        verified = corrupt = verified_bytes = 0
+        for name in os.listdir(folder):
+            post_id = int(name.split('.')[0])
+            path = os.path.join(folder, name)
+            if file_md5(path) == posts.md5(post_id):
+                verified += 1
+                verified_bytes += os.path.getsize(path)
+            else:
+                corrupt += 1
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'requested': case['posts'],
+        'reported_downloaded': downloaded,
+        'verified': verified,
+        'corrupt': corrupt,
+        'shortfall': case['posts'] - verified,
+        'seconds': round(wall, 3),
+        'goodput_mb_per_s': round(verified_bytes / (1024 * 1024) / wall, 3) if wall else 0,
+    }
+
+
+def fetch_server_stats(api_base):
+    import urllib.request
+    with urllib.request.urlopen(f"{api_base}/_stats", timeout=5) as response:
+        return json.load(response)
+
+
+def spawn_case(case):
+    with tempfile.NamedTemporaryFile('r', suffix=".json", delete=False) as out:
+        result_path = out.name
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case),
+                               '--result-file', result_path], stdout=subprocess.DEVNULL)
+        if proc.returncode != 0:
+            return {'requested': case['posts'], 'error': f"run failed (exit {proc.returncode})",
+                    'verified': 0, 'shortfall': case['posts'], 'goodput_mb_per_s': 0}
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Scraper throughput under injected faults")
+    parser.add_argument('--profiles', default=",".join(p for p in FAULT_PROFILES),
+                        help="comma-separated fault profiles")
+    parser.add_argument('--posts', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--sizes', default='small')
+    parser.add_argument('--size-scale', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--fault-rate', type=float, default=None, help="override every fault probability")
+    parser.add_argument('--fault-seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=300, help="give up on a case after this many seconds")
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.run_case:
+        write_json(args.result_file, run_case(json.loads(args.run_case)))
+        return 0
+
+    server_posts = args.posts * 2
+    results = []
+    print(f"{'profile':<16}{'verified':>9}{'corrupt':>9}{'lost':>6}{'short':>7}{'seconds':>9}{'goodput MB/s':>14}")
+    for profile in [p for p in args.profiles.split(',') if p]:
+        extra = ['--faults', profile, '--fault-seed', str(args.fault_seed)]
+        if args.fault_rate is not None:
+            extra += ['--fault-rate', str(args.fault_rate)]
+        server, api_base = start_mock_server(server_posts, args.sizes, args.size_scale, args.latency,
+                                             extra_args=extra)
+        try:
+            case = {'profile': profile, 'posts': args.posts, 'concurrency': args.concurrency,
+                    'sizes': args.sizes, 'size_scale': args.size_scale, 'server_posts': server_posts,
+                    'timeout': args.timeout, 'api_base': api_base}
+            result = spawn_case(case)
+            server_stats = fetch_server_stats(api_base)
+            result['profile'] = profile
+            result['faults_injected'] = server_stats.get('faults', {})
+            result['lost'] = max(server_stats.get('posts_requested', 0) - result['verified'], 0)
+        finally:
+            stop_mock_server(server)
+        results.append(result)
+        print(f"{profile:<16}{result['verified']:>9}{result.get('corrupt', '-'):>9}{result['lost']:>6}"
+              f"{result['shortfall']:>7}{result.get('seconds', '-'):>9}{result['goodput_mb_per_s']:>14}")
+        if result.get('error'):
+            print(f"  {result['error']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("chaos-%Y%m%d-%H%M%S.json"))
+    write_json(output, {'created': datetime.now().isoformat(), 'settings': vars(args), 'results': results})
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Microbenchmarks for the local (non-network) hot spots.
+
+Times DuplicateDetector.load_existing_hashes, DuplicateDetector.get_data_hash,
+DownloadHistory.save_history / load_history / add_entry and zip_folder over synthetic
+folders and histories at several scales.
+
+    python benchmarks/bench_local.py --scales 1k,100k
+    python benchmarks/bench_local.py --scales 1k,100k,1m --workdir /tmp/ys-fixtures
+    python benchmarks/bench_local.py --compare benchmarks/baselines/local.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+DEFAULT_BASELINE = os.path.join(HERE, "baselines", "local.json")
+
+sys.path.insert(0, HERE)
+from _scraper import load_scraper  # noqa: E402
+
+
+def parse_scale(value):
+    value = value.strip().lower()
+    if value.endswith('m'):
+        return int(float(value[:-1]) * 1_000_000)
+    if value.endswith('k'):
+        return int(float(value[:-1]) * 1_000)
+    return int(value)
+
+
+def make_folder(path, count, file_size):
+    """Create `count` files of about `file_size` bytes; reused if already complete"""
+    marker = os.path.join(os.path.dirname(path), os.path.basename(path) + ".done")
+    if os.path.exists(marker):
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    rng = random.Random(count)
+    filler = rng.randbytes(file_size)
+    for post_id in range(1, count + 1):
+        ext = 'jpg' if post_id % 4 else 'png'
+        with open(os.path.join(path, f"{post_id}.{ext}"), 'wb') as f:
+            f.write(post_id.to_bytes(8, 'little') + filler)
+    open(marker, 'w').close()
+
+
+def make_history(count):
+    start = datetime(2024, 1, 1)
+    rng = random.Random(count)
+    entries = []
+    for i in range(count):
+        size = rng.randint(1, 5000) * 1024 * 1024
+        duration = rng.uniform(5, 3600)
+        entries.append({
+            'timestamp': (start + timedelta(minutes=i)).isoformat(),
+            'query_tags': f"tag_{i % 500} rating:s",
+            'file_count': rng.randint(1, 320),
+            'total_size_bytes': size,
+            'duration_seconds': duration,
+            'folder_name': f"tag_{i % 500}_rating-s",
+            'avg_speed_mbps': (size / (1024 * 1024)) / (duration / 60),
+            'skipped_duplicates': rng.randint(0, 20),
+        })
+    return entries
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_scale(scraper, workdir, count, file_size, repeat, skip):
+    folder = os.path.join(workdir, f"folder-{count}")
+    results = {}
+
+    if 'hashes' not in skip or 'zip' not in skip:
+        make_folder(folder, count, file_size)
+
+    if 'hashes' not in skip:
+        results['load_existing_hashes'] = best_of(repeat, lambda: scraper.DuplicateDetector(folder))
+
+    if 'md5' not in skip:
+        detector = scraper.DuplicateDetector(os.path.join(workdir, "missing"))
+        blob = random.Random(0).randbytes(file_size)
+        results['get_data_hash'] = best_of(repeat, lambda: [detector.get_data_hash(blob) for _ in range(count)])
+
+    if 'history' not in skip:
+        history_path = os.path.join(workdir, f"history-{count}.jsonl")
+        entries = make_history(count)
+
+        def save():
+            history = scraper.DownloadHistory(history_path)
+            history.history = entries
+            history.save_history()
+
+        def append():
+            history = scraper.DownloadHistory(history_path)
+            history.add_entry("bench", 1, 1024, 1.0, "bench")
+
+        results['save_history'] = best_of(repeat, save)
+        results['load_history'] = best_of(repeat, lambda: scraper.DownloadHistory(history_path).history)
+        save()
+        results['add_entry'] = best_of(repeat, append)
+
+    if 'zip' not in skip:
+        zip_path = os.path.join(workdir, f"folder-{count}.zip")
+        results['zip_folder'] = best_of(repeat, lambda: scraper.zip_folder(folder, zip_path))
+        os.remove(zip_path)
+
+    return {name: round(seconds, 4) for name, seconds in results.items()}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scale, timings in results.items():
+        old = baseline.get('results', {}).get(scale, {})
+        for name, seconds in timings.items():
+            before = old.get(name)
+            if before and seconds > before * (1 + tolerance):
+                regressions.append(f"{scale} {name}: {before}s -> {seconds}s ({(seconds / before - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def write_json(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local component microbenchmarks")
+    parser.add_argument('--scales', default="1k,100k", help="comma-separated sizes, e.g. 1k,100k,1m")
+    parser.add_argument('--file-size', type=int, default=1024, help="bytes per synthetic file")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement (best is kept)")
+    parser.add_argument('--skip', default="", help="comma-separated: hashes,md5,history,zip")
+    parser.add_argument('--workdir', default=None, help="keep generated fixtures here for reuse")
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, default=None)
+    parser.add_argument('--compare', default=None, help="baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.20, help="allowed slowdown fraction")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    scraper = load_scraper()
+    skip = {s for s in args.skip.split(',') if s}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ys-microbench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = {}
+    try:
+        for label in [s for s in args.scales.split(',') if s]:
+            count = parse_scale(label)
+            print(f"[{label}] {count} items")
+            results[label] = bench_scale(scraper, workdir, count, args.file_size, args.repeat, skip)
+            for name, seconds in results[label].items():
+                print(f"  {name:<22}{seconds * 1000:>12.1f} ms")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    payload = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'file_size': args.file_size, 'repeat': args.repeat},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("local-%Y%m%d-%H%M%S.json"))
+    write_json(output, payload)
+    print(f"\nResults written to {output}")
+    if args.save_baseline:
+        write_json(args.save_baseline, payload)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Startup-time benchmark for the CLI commands that should feel instant.
+
+Runs each command in a fresh interpreter several times (in an empty scratch
+directory, so no history or catalog is read) and compares the best wall time
+against a budget. Bare interpreter start-up (`python -c pass`) is measured
+too and subtracted, since site-packages and .pth files differ per machine.
+Bytecode caching is forced on, so modules load from warm .pyc files as
+they would on a normal install. With --imports the slowest top-level
+imports of each command are listed, taken from `python -X importtime`.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --budget-ms 100 --imports
+    python benchmarks/bench_startup.py --commands "--help;history stats;catalog stats"
+"""
+import argparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+RESULTS_DIR = os.path.join(HERE, "results")
+
+sys.path.insert(0, HERE)
+from bench_throughput import write_json  # noqa: E402
+
+
+def bytecode_env():
+    """Environment with bytecode caching on, as on a normal install (warm .pyc files)"""
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def best_wall(cmd, cwd, runs):
+    env = bytecode_env()
+    # One untimed run writes the .pyc files
+    subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def slowest_imports(cmd, cwd, top):
+    """Top-level modules by cumulative import time (microseconds) from -X importtime"""
+    proc = subprocess.run([cmd[0], '-X', 'importtime'] + cmd[1:], cwd=cwd, env=bytecode_env(),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        # Nested imports are indented under their parent; keep top-level ones
+        if not cumulative.strip().isdigit() or name.startswith("  ") or name.strip() == "site":
+            continue
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="CLI startup-time benchmark")
+    parser.add_argument('--script', default=os.path.join(ROOT, "1.0.1.py"))
+    parser.add_argument('--commands', default="--help;history stats;catalog stats",
+                        help="semicolon-separated argument lists")
+    parser.add_argument('--runs', type=int, default=10, help="runs per command (best is kept)")
+    parser.add_argument('--budget-ms', type=float, default=100, help="allowed time above bare interpreter start")
+    parser.add_argument('--imports', action='store_true', help="list the slowest imports per command")
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--output', default=None)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    workdir = tempfile.mkdtemp(prefix="ys-startup-")
+    results = {}
+    try:
+        interpreter = best_wall([sys.executable, '-c', 'pass'], workdir, args.runs)
+        print(f"{'bare interpreter':<24}{interpreter * 1000:>9.1f} ms")
+        for command in [c.strip() for c in args.commands.split(';') if c.strip()]:
+            cmd = [sys.executable, args.script] + command.split()
+            wall = best_wall(cmd, workdir, args.runs)
+            own = wall - interpreter
+            results[command] = {'wall_ms': round(wall * 1000, 1), 'own_ms': round(own * 1000, 1),
+                                'over_budget': own * 1000 > args.budget_ms}
+            flag = "  OVER BUDGET" if results[command]['over_budget'] else ""
+            print(f"{command:<24}{wall * 1000:>9.1f} ms  (+{own * 1000:.1f} ms){flag}")
+            if args.imports:
+                imports = slowest_imports(cmd, workdir, args.top)
+                results[command]['imports_us'] = dict((name, us) for us, name in imports)
+                for us, name in imports:
+                    print(f"    {name:<28}{us / 1000:>8.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("startup-%Y%m%d-%H%M%S.json"))
+    write_json(output, {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'script': args.script, 'runs': args.runs, 'budget_ms': args.budget_ms},
+        'interpreter_ms': round(interpreter * 1000, 1),
+        'results': results,
+    })
+    print(f"\nResults written to {output}")
+    over = [command for command, result in results.items() if result['over_budget']]
+    if over:
+        print(f"Over the {args.budget_ms:.0f} ms budget: {', '.join(over)}")
+        return 1
+    print(f"All commands within the {args.budget_ms:.0f} ms budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
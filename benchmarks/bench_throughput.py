@@ -0,0 +1,232 @@
+"""
+End-to-end throughput benchmark against the local mock e621 server.
+
+Runs start_scraper over a matrix of concurrency levels and file mixes and
+reports files/s, MB/s, peak RSS and CPU%. Every case runs in a fresh child
+process so peak RSS and CPU time belong to that case only.
+
+    python benchmarks/bench_throughput.py --concurrency 1,5,20 --mixes small,mixed
+    python benchmarks/bench_throughput.py --save-baseline
+    python benchmarks/bench_throughput.py --compare benchmarks/baselines/throughput.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+DEFAULT_BASELINE = os.path.join(HERE, "baselines", "throughput.json")
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(posts, sizes, size_scale=1.0, latency=0.0, bandwidth=None, extra_args=()):
+    """Start mock_e621.py in a child process and wait until it accepts connections"""
+    port = free_port()
+    cmd = [sys.executable, os.path.join(HERE, "mock_e621.py"), '--port', str(port),
+           '--posts', str(posts), '--sizes', sizes, '--size-scale', str(size_scale),
+           '--latency', str(latency)]
+    if bandwidth:
+        cmd += ['--bandwidth', str(bandwidth)]
+    cmd += list(extra_args)
+    proc = subprocess.Popen(cmd)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError("mock server exited during startup")
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("mock server did not start")
+
+
+def stop_mock_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def cpu_seconds():
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_case(case):
+    """Child-process side: drive start_scraper once and measure it"""
+    sys.path.insert(0, HERE)
+    from _scraper import load_scraper
+    scraper = load_scraper()
+    scraper.API_BASE = case['api_base']
+    scraper.PAGE_DELAY = 0
+
+    folder = tempfile.mkdtemp(prefix="ys-bench-")
+    try:
+        tracker = scraper.DownloadTracker()
+        detector = scraper.DuplicateDetector(folder)
+        cpu_start = cpu_seconds()
+        wall_start = time.perf_counter()
+        downloaded, skipped = asyncio.run(scraper.start_scraper(
+            query_tags=case.get('tags', ''),
+            total_images=case['posts'],
+            thread_limit=case['concurrency'],
+            download_folder=folder,
+            tracker=tracker,
+            duplicate_detector=detector,
+        ))
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_start
+        size = tracker.downloaded_size
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'files': downloaded,
+        'skipped': skipped,
+        'bytes': size,
+        'seconds': round(wall, 4),
+        'files_per_s': round(downloaded / wall, 2) if wall else 0,
+        'mb_per_s': round(size / (1024 * 1024) / wall, 2) if wall else 0,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource else None,
+        'cpu_percent': round(cpu / wall * 100, 1) if wall else 0,
+    }
+
+
+def spawn_case(case):
+    with tempfile.NamedTemporaryFile('r', suffix=".json", delete=False) as out:
+        result_path = out.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case),
+                        '--result-file', result_path], check=True, stdout=subprocess.DEVNULL)
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def case_key(case):
+    return f"{case['mix']}/c{case['concurrency']}"
+
+
+def compare(results, baseline, tolerance):
+    """Return human readable regressions of files/s or MB/s beyond tolerance"""
+    previous = {case_key(r['case']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result['case']))
+        if not old:
+            continue
+        for metric in ('files_per_s', 'mb_per_s'):
+            before, after = old[metric], result[metric]
+            if before and after < before * (1 - tolerance):
+                regressions.append(f"{case_key(result['case'])} {metric}: {before} -> {after} "
+                                   f"({(after / before - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def write_json(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Scraper throughput benchmark")
+    parser.add_argument('--concurrency', default="1,5,10,20", help="comma-separated levels")
+    parser.add_argument('--mixes', default="small,mixed", help="comma-separated size distributions")
+    parser.add_argument('--posts', type=int, default=300, help="posts downloaded per case")
+    parser.add_argument('--size-scale', type=float, default=0.1, help="shrink/grow all file sizes")
+    parser.add_argument('--latency', type=float, default=0.02, help="server latency per response (s)")
+    parser.add_argument('--bandwidth', default="20MB", help="per-connection bandwidth, '' for unlimited")
+    parser.add_argument('--output', default=None, help="result file (default: benchmarks/results/...)")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, default=None)
+    parser.add_argument('--compare', default=None, help="baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed slowdown fraction")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.run_case:
+        write_json(args.result_file, run_case(json.loads(args.run_case)))
+        return 0
+
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+    mixes = [m for m in args.mixes.split(',') if m]
+    results = []
+    print(f"{'case':<16}{'files':>7}{'files/s':>10}{'MB/s':>9}{'RSS MB':>9}{'CPU%':>7}")
+    for mix in mixes:
+        server, api_base = start_mock_server(args.posts, mix, args.size_scale, args.latency, args.bandwidth or None)
+        try:
+            for level in levels:
+                case = {'mix': mix, 'concurrency': level, 'posts': args.posts, 'api_base': api_base}
+                result = spawn_case(case)
+                result['case'] = {k: v for k, v in case.items() if k != 'api_base'}
+                results.append(result)
+                print(f"{case_key(case):<16}{result['files']:>7}{result['files_per_s']:>10}"
+                      f"{result['mb_per_s']:>9}{result['peak_rss_mb'] or '-':>9}{result['cpu_percent']:>7}")
+        finally:
+            stop_mock_server(server)
+
+    payload = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'size_scale': args.size_scale, 'latency': args.latency, 'bandwidth': args.bandwidth},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("throughput-%Y%m%d-%H%M%S.json"))
+    write_json(output, payload)
+    print(f"\nResults written to {output}")
+    if args.save_baseline:
+        write_json(args.save_baseline, payload)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
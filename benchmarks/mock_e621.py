@@ -0,0 +1,363 @@
+"""
+Local stand-in for the parts of the e621 API the scraper uses.
+
+Serves /posts.json pagination (plus id: ranges and id:/md5: list lookups)
+and pools over a deterministic synthetic post set and the matching media
+files (with sample/preview variants) under /data/, with injectable latency
+and bandwidth and an optional fault profile (see FAULT_PROFILES).
+
+    python benchmarks/mock_e621.py --port 8621 --posts 2000 --sizes mixed
+    python benchmarks/mock_e621.py --faults chaos --fault-seed 7
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+
+from aiohttp import web
+
+KB = 1024
+MB = 1024 * 1024
+
+# name -> list of (weight, ext, min_bytes, max_bytes)
+SIZE_DISTRIBUTIONS = {
+    'tiny': [(1, 'jpg', 4 * KB, 32 * KB)],
+    'small': [(8, 'jpg', 50 * KB, 500 * KB), (2, 'png', 200 * KB, 1 * MB)],
+    'mixed': [(70, 'jpg', 100 * KB, 2 * MB), (25, 'gif', 2 * MB, 10 * MB), (5, 'webm', 10 * MB, 50 * MB)],
+    'large': [(1, 'png', 5 * MB, 20 * MB), (1, 'webm', 20 * MB, 50 * MB)],
+}
+
+# Per-response probabilities for each kind of misbehaviour
+FAULT_PROFILES = {
+    'none': {},
+    'rate_limit': {'rate_limit': 0.10},
+    'burst_5xx': {'burst_5xx': 0.02},
+    'reset': {'reset': 0.05},
+    'truncated': {'truncated': 0.05},
+    'slow_drip': {'slow_drip': 0.05},
+    'malformed_json': {'malformed_json': 0.20},
+    'chaos': {'rate_limit': 0.03, 'burst_5xx': 0.01, 'reset': 0.02, 'truncated': 0.02,
+              'slow_drip': 0.02, 'malformed_json': 0.05},
+}
+FILE_FAULTS = ('rate_limit', 'burst_5xx', 'reset', 'truncated', 'slow_drip')
+LISTING_FAULTS = ('rate_limit', 'burst_5xx', 'malformed_json')
+
+RATINGS = ['s', 'q', 'e']
+TAG_POOL = [f"tag_{i}" for i in range(200)]
+SAMPLE_WIDTH = 850
+PREVIEW_BYTES = 8 * KB
+
+
+def parse_size(value):
+    """Parse '512KB', '10MB', '1.5GB' or a plain byte count"""
+    value = str(value).strip().upper()
+    for suffix, factor in (('GB', 1024 * MB), ('MB', MB), ('KB', KB), ('B', 1)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(float(value))
+
+
+class SyntheticPosts:
+    """Deterministic post set: ids run from `count` down to 1, newest first"""
+    def __init__(self, count, sizes='mixed', size_scale=1.0, seed=0):
+        self.count = count
+        self.seed = seed
+        self.distribution = SIZE_DISTRIBUTIONS[sizes]
+        self.size_scale = size_scale
+        self.base_url = ""
+        self._posts = {}
+        self._md5 = {}
+        self._by_md5 = None
+
+    def post(self, post_id):
+        post = self._posts.get(post_id)
+        if post is None:
+            rng = random.Random(self.seed * 1_000_003 + post_id)
+            weights = [entry[0] for entry in self.distribution]
+            _, ext, low, high = rng.choices(self.distribution, weights)[0]
+            size = max(1, int(rng.randint(low, high) * self.size_scale))
+            tags = sorted(rng.sample(TAG_POOL, 12))
+            post = {
+                'id': post_id,
+                'ext': ext,
+                'size': size,
+                'rating': rng.choice(RATINGS),
+                'score': rng.randint(-20, 500),
+                'tags': tags,
+                'width': rng.randint(200, 4000),
+                'height': rng.randint(200, 4000),
+            }
+            self._posts[post_id] = post
+        return post
+
+    def has_sample(self, post_id):
+        return self.post(post_id)['width'] > SAMPLE_WIDTH
+
+    def variant_size(self, post_id, variant='original'):
+        """Samples shrink with the pixel count (down to 850px wide), previews are a small thumbnail"""
+        post = self.post(post_id)
+        if variant == 'sample' and self.has_sample(post_id):
+            return max(1, int(post['size'] * (SAMPLE_WIDTH / post['width']) ** 2))
+        if variant == 'preview':
+            return min(post['size'], PREVIEW_BYTES)
+        return post['size']
+
+    def content(self, post_id, variant='original'):
+        """File body: a per-post 64-byte block repeated up to the post's size"""
+        size = self.variant_size(post_id, variant)
+        key = f"{self.seed}:{post_id}" if variant == 'original' else f"{self.seed}:{post_id}:{variant}"
+        block = hashlib.sha512(key.encode()).digest()
+        repeats = size // len(block) + 1
+        return (block * repeats)[:size]
+
+    def md5(self, post_id):
+        digest = self._md5.get(post_id)
+        if digest is None:
+            digest = hashlib.md5(self.content(post_id)).hexdigest()
+            self._md5[post_id] = digest
+        return digest
+
+    def to_json(self, post_id):
+        post = self.post(post_id)
+        url = f"{self.base_url}/data/{post_id}.{post['ext']}"
+        if self.has_sample(post_id):
+            sample = {'has': True, 'width': SAMPLE_WIDTH, 'height': post['height'] * SAMPLE_WIDTH // post['width'],
+                      'url': f"{self.base_url}/data/sample/{post_id}.jpg"}
+        else:
+            sample = {'has': False, 'width': post['width'], 'height': post['height'], 'url': url}
+        return {
+            'id': post_id,
+            'created_at': "2024-01-01T00:00:00.000-00:00",
+            'file': {
+                'width': post['width'],
+                'height': post['height'],
+                'ext': post['ext'],
+                'size': post['size'],
+                'md5': self.md5(post_id),
+                'url': url,
+            },
+            'preview': {'width': 150, 'height': 150, 'url': f"{self.base_url}/data/preview/{post_id}.jpg"},
+            'sample': sample,
+            'score': {'up': max(post['score'], 0), 'down': min(post['score'], 0), 'total': post['score']},
+            'tags': {'general': post['tags'], 'artist': [], 'species': [], 'character': [],
+                     'copyright': [], 'meta': [], 'lore': [], 'invalid': []},
+            'rating': post['rating'],
+            'fav_count': 0,
+        }
+
+    def lookup(self, tag):
+        """Ids matched by an id:1,2,3 or md5:a,b list tag, newest first"""
+        kind, _, values = tag.partition(':')
+        if kind == 'id':
+            ids = {int(value) for value in values.split(',') if value.isdigit()}
+        else:
+            if self._by_md5 is None:
+                self._by_md5 = {self.md5(post_id): post_id for post_id in range(1, self.count + 1)}
+            ids = {self._by_md5[value] for value in values.split(',') if value in self._by_md5}
+        return sorted((post_id for post_id in ids if 1 <= post_id <= self.count), reverse=True)
+
+    def select(self, limit, page, low=1, high=None):
+        """Ids for one listing page within [low, high]; page is a number or a b<id>/a<id> cursor"""
+        top = min(self.count, high or self.count)
+        low = max(low, 1)
+        page = str(page or "1")
+        if page.startswith('b'):
+            start = min(int(page[1:]) - 1, top)
+        elif page.startswith('a'):
+            first = max(int(page[1:]) + 1, low)
+            return list(range(min(first + limit - 1, top), first - 1, -1))
+        else:
+            start = top - (int(page) - 1) * limit
+        return list(range(start, max(start - limit, low - 1), -1))
+
+
+def id_range(tag):
+    """(low, high) for an id:a..b, id:<N, id:<=N, id:>N or id:>=N range tag, else None"""
+    match = re.match(r"^id:(?:(\d+)\.\.(\d+)|(<=?|>=?)(\d+))$", tag)
+    if not match:
+        return None
+    if match.group(1):
+        return int(match.group(1)), int(match.group(2))
+    op, value = match.group(3), int(match.group(4))
+    return {'<': (1, value - 1), '<=': (1, value), '>': (value + 1, None), '>=': (value, None)}[op]
+
+
+class FaultInjector:
+    """
+    Decides which fault (if any) a response gets. A 5xx burst makes the next
+    `burst_length` responses fail as well, whatever they are for.
+    """
+    def __init__(self, rates, seed=0, retry_after=1, burst_length=10, drip_rate=16 * KB):
+        self.rates = dict(rates)
+        self.rng = random.Random(seed)
+        self.retry_after = retry_after
+        self.burst_length = burst_length
+        self.drip_rate = drip_rate
+        self.burst_remaining = 0
+        self.counts = {}
+
+    def pick(self, kinds):
+        if self.burst_remaining > 0:
+            self.burst_remaining -= 1
+            return self.record('burst_5xx')
+        for kind in kinds:
+            rate = self.rates.get(kind, 0)
+            if rate and self.rng.random() < rate:
+                if kind == 'burst_5xx':
+                    self.burst_remaining = self.burst_length - 1
+                return self.record(kind)
+        return None
+
+    def record(self, kind):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        return kind
+
+    def error_response(self, kind):
+        if kind == 'rate_limit':
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)},
+                                text="Rate limit exceeded")
+        return web.Response(status=self.rng.choice([500, 502, 503, 504]), text="upstream error")
+
+
+class MockE621:
+    def __init__(self, posts, latency=0.0, bandwidth=None, chunk_size=64 * KB, faults=None):
+        self.posts = posts
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+        self.faults = faults or FaultInjector({})
+        self.stats = {'listing_requests': 0, 'file_requests': 0, 'bytes_sent': 0}
+        self.requested_ids = set()
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def handle_posts(self, request):
+        self.stats['listing_requests'] += 1
+        await self.delay()
+        fault = self.faults.pick(LISTING_FAULTS)
+        if fault in ('rate_limit', 'burst_5xx'):
+            return self.faults.error_response(fault)
+        limit = min(int(request.query.get('limit', 75)), 320)
+        tags = request.query.get('tags', '').split()
+        ranges = [id_range(tag) for tag in tags if id_range(tag)]
+        list_tags = [tag for tag in tags if tag.startswith(('id:', 'md5:')) and not id_range(tag)]
+        if list_tags:
+            ids = self.posts.lookup(list_tags[0])[:limit]
+        else:
+            low, high = ranges[0] if ranges else (1, None)
+            ids = self.posts.select(limit, request.query.get('page'), low, high)
+        body = json.dumps({'posts': [self.posts.to_json(post_id) for post_id in ids]})
+        if fault == 'malformed_json':
+            body = body[:len(body) // 2]
+        return web.Response(text=body, content_type='application/json')
+
+    async def handle_pool(self, request):
+        """A pool or set: 10-60 posts in a fixed, non-sorted page order"""
+        self.stats['listing_requests'] += 1
+        await self.delay()
+        pool_id = int(request.match_info['pool_id'])
+        rng = random.Random(pool_id)
+        post_ids = rng.sample(range(1, self.posts.count + 1), min(rng.randint(10, 60), self.posts.count))
+        return web.json_response({'id': pool_id, 'name': f"Mock_Comic_{pool_id}", 'post_ids': post_ids,
+                                  'post_count': len(post_ids)})
+
+    async def handle_file(self, request):
+        self.stats['file_requests'] += 1
+        post_id = int(request.match_info['post_id'])
+        if not 1 <= post_id <= self.posts.count:
+            raise web.HTTPNotFound()
+        self.requested_ids.add(post_id)
+        await self.delay()
+        fault = self.faults.pick(FILE_FAULTS)
+        if fault in ('rate_limit', 'burst_5xx'):
+            return self.faults.error_response(fault)
+
+        body = self.posts.content(post_id, request.match_info.get('variant', 'original'))
+        response = web.StreamResponse(headers={'Content-Type': 'application/octet-stream'})
+        if fault == 'truncated':
+            # Chunked encoding with an early terminator: the client sees a
+            # well-formed but short body, only an md5 check can catch it
+            body = body[:len(body) // 2]
+        else:
+            response.content_length = len(body)
+        await response.prepare(request)
+        if fault == 'reset':
+            await self.send_body(response, body[:len(body) // 2])
+            request.transport.abort()
+            return response
+        bandwidth = self.faults.drip_rate if fault == 'slow_drip' else self.bandwidth
+        await self.send_body(response, body, bandwidth)
+        await response.write_eof()
+        return response
+
+    async def send_body(self, response, body, bandwidth=None):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = 0
+        chunk_size = min(self.chunk_size, bandwidth) if bandwidth else self.chunk_size
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            await response.write(chunk)
+            sent += len(chunk)
+            self.stats['bytes_sent'] += len(chunk)
+            if bandwidth:
+                ahead = sent / bandwidth - (loop.time() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats, posts_requested=len(self.requested_ids),
+                                      faults=self.faults.counts))
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/posts.json', self.handle_posts)
+        app.router.add_get('/data/{post_id:\\d+}.{ext}', self.handle_file)
+        app.router.add_get('/data/{variant:sample|preview}/{post_id:\\d+}.{ext}', self.handle_file)
+        app.router.add_get('/pools/{pool_id:\\d+}.json', self.handle_pool)
+        app.router.add_get('/post_sets/{pool_id:\\d+}.json', self.handle_pool)
+        app.router.add_get('/_stats', self.handle_stats)
+        return app
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local mock of the e621 posts API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8621)
+    parser.add_argument('--posts', type=int, default=2000, help="number of synthetic posts")
+    parser.add_argument('--sizes', choices=sorted(SIZE_DISTRIBUTIONS), default='mixed')
+    parser.add_argument('--size-scale', type=float, default=1.0, help="multiply every file size by this")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added before every response")
+    parser.add_argument('--bandwidth', default=None, help="per-connection cap, e.g. 10MB (bytes/s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--faults', choices=sorted(FAULT_PROFILES), default='none', help="fault profile")
+    parser.add_argument('--fault-rate', type=float, default=None,
+                        help="override the probability of every fault in the profile")
+    parser.add_argument('--fault-seed', type=int, default=0)
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+    return parser
+
+
+def server_from_args(args):
+    posts = SyntheticPosts(args.posts, args.sizes, args.size_scale, args.seed)
+    posts.base_url = f"http://{args.host}:{args.port}"
+    bandwidth = parse_size(args.bandwidth) if args.bandwidth else None
+    rates = dict(FAULT_PROFILES[args.faults])
+    if args.fault_rate is not None:
+        rates = {kind: args.fault_rate for kind in rates}
+    faults = FaultInjector(rates, seed=args.fault_seed, retry_after=args.retry_after)
+    return MockE621(posts, latency=args.latency, bandwidth=bandwidth, faults=faults)
+
+
+def main():
+    args = build_parser().parse_args()
+    server = server_from_args(args)
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+
+from yiffscraper import FairSlots
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_round_robin_between_jobs():
+    async def main():
+        slots = FairSlots(1)
+        order = []
+
+        async def download(key, n):
+            async with slots.job(key):
+                order.append((key, n))
+                await asyncio.sleep(0)
+
+        await slots.acquire('big')
+        tasks = [asyncio.create_task(download('big', n)) for n in range(4)]
+        await settle()
+        tasks += [asyncio.create_task(download('small', n)) for n in range(2)]
+        await settle()
+        assert (slots.waiting('big'), slots.waiting('small')) == (4, 2)
+        slots.release()
+        await asyncio.gather(*tasks)
+        return order, slots
+
+    order, slots = asyncio.run(main())
+    assert order == [('big', 0), ('small', 0), ('big', 1), ('small', 1), ('big', 2), ('big', 3)]
+    assert slots.active == 0
+    assert slots.waiting() == 0
+
+
+def test_limit_is_respected():
+    async def main():
+        slots = FairSlots(2)
+        running = peak = 0
+
+        async def download(key):
+            nonlocal running, peak
+            async with slots.job(key):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.001)
+                running -= 1
+
+        await asyncio.gather(*(download(key) for key in 'abc' * 4))
+        return peak, slots.active
+
+    assert asyncio.run(main()) == (2, 0)
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def main():
+        slots = FairSlots(1)
+        await slots.acquire('a')
+        waiter = asyncio.create_task(slots.acquire('b'))
+        await settle()
+        assert slots.waiting('b') == 1
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert slots.waiting() == 0
+        assert 'b' not in slots.queues
+
+        slots.release()
+        return slots.active
+
+    assert asyncio.run(main()) == 0
+
+
+def test_cancel_after_handover_passes_slot_on():
+    async def main():
+        slots = FairSlots(1)
+        await slots.acquire('a')
+        first = asyncio.create_task(slots.acquire('b'))
+        second = asyncio.create_task(slots.acquire('c'))
+        await settle()
+
+        # The slot goes to 'b', which is cancelled before it gets to run
+        slots.release()
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.wait_for(second, 1)
+        assert slots.active == 1
+
+        slots.release()
+        return slots.active, slots.waiting()
+
+    assert asyncio.run(main()) == (0, 0)
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from yiffscraper import DownloadHistory, HistoryStats
+
+
+def entry(query, files, size, seconds, hour=12, threads=8):
+    return {
+        'timestamp': datetime(2024, 1, 1, hour).isoformat(), 'query_tags': query,
+        'file_count': files, 'total_size_bytes': size, 'duration_seconds': seconds, 'thread_count': threads,
+    }
+
+
+@pytest.fixture
+def history(tmp_path):
+    return DownloadHistory(str(tmp_path / "download_history.jsonl"))
+
+
+def write(history, *entries):
+    with open(history.history_file, 'a') as f:
+        for e in entries:
+            f.write(json.dumps(e) + "\n")
+
+
+def test_refresh_reads_only_new_entries(history):
+    stats = HistoryStats(history)
+    write(history, entry("fox", 10, 1000, 10))
+    assert stats.refresh()['all']['runs'] == 1
+
+    write(history, entry("Fox", 20, 2000, 10))
+    with open(history.history_file, 'a') as f:
+        f.write('{"partial": ')
+    data = stats.refresh()
+    assert data['by_query']['fox']['files'] == 30
+    assert data['offset'] < len(open(history.history_file, 'rb').read())
+
+    # A fresh instance starts from the saved index
+    assert HistoryStats(history).refresh()['all'] == data['all']
+
+
+def test_rebuilds_after_log_shrinks(history):
+    stats = HistoryStats(history)
+    write(history, entry("fox", 10, 1000, 10), entry("wolf", 10, 1000, 10))
+    stats.refresh()
+    with open(history.history_file, 'w') as f:
+        f.write(json.dumps(entry("cat", 5, 500, 5)) + "\n")
+    assert list(stats.refresh()['by_query']) == ['cat']
+
+
+def test_predict_prefers_query_history(history):
+    stats = HistoryStats(history)
+    assert stats.predict("fox", 10) is None
+
+    write(history, entry("fox", 10, 1000, 10), entry("fox", 10, 1000, 10), entry("wolf", 10, 4000, 1))
+    prediction = stats.predict("fox", 20, when=datetime(2024, 1, 1, 3))
+    assert prediction['basis'] == 'query'
+    assert prediction['bytes'] == 2000
+    assert prediction['seconds'] == pytest.approx(20)
+
+
+def test_predict_falls_back_and_scales_by_hour(history):
+    stats = HistoryStats(history)
+    write(history,
+          entry("fox", 10, 1000, 10, hour=1), entry("wolf", 10, 1000, 30, hour=13),
+          entry("cat", 10, 1000, 10, hour=1))
+    prediction = stats.predict("dragon", 10, thread_count=4, when=datetime(2024, 1, 1, 1), total_bytes=1000)
+    assert prediction['basis'] == 'all'
+    # 3000 bytes in 50s overall, 2000 bytes in 20s at 1am
+    assert prediction['seconds'] == pytest.approx(1000 / (3000 / 50 * (100 / 60)))
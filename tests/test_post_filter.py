@@ -0,0 +1,71 @@
+import pytest
+
+from yiffscraper import PostFilter, parse_size
+
+
+def post(**fields):
+    file_info = {key: fields.pop(key) for key in ('ext', 'size', 'width', 'height') if key in fields}
+    result = {'id': fields.pop('id', 1), 'file': file_info}
+    if 'score' in fields:
+        result['score'] = {'total': fields.pop('score')}
+    if 'tags' in fields:
+        result['tags'] = {'general': fields.pop('tags')}
+    result.update(fields)
+    return result
+
+
+def test_parse_size():
+    assert parse_size("512KB") == 512 * 1024
+    assert parse_size("1.5gb") == int(1.5 * 1024 ** 3)
+    assert parse_size(" 20 MB") == 20 * 1024 ** 2
+    assert parse_size("100") == 100
+
+
+def test_numeric_rules():
+    post_filter = PostFilter(["size<20MB", "score>=10"])
+    assert post_filter.rejects(post(size=1024, score=10)) is None
+    assert post_filter.rejects(post(size=30 * 1024 ** 2, score=50)) == "size<20MB"
+    assert post_filter.rejects(post(size=1024, score=3)) == "score>=10"
+
+
+def test_list_rules():
+    post_filter = PostFilter(["ext!=webm,.gif", "rating=s,questionable"])
+    assert post_filter.rejects(post(ext="png", rating="q")) is None
+    assert post_filter.rejects(post(ext="gif", rating="s")) == "ext!=webm,.gif"
+    assert post_filter.rejects(post(ext="png", rating="e")) == "rating=s,questionable"
+
+
+def test_tag_rules():
+    post_filter = PostFilter(["-comic", "tags=solo,duo"])
+    assert post_filter.rejects(post(tags=["solo", "fox"])) is None
+    assert post_filter.rejects(post(tags=["solo", "comic"])) == "-comic"
+    assert post_filter.rejects(post(tags=["group"])) == "tags=solo,duo"
+
+
+def test_missing_fields_are_kept():
+    assert PostFilter(["size<1KB", "ext=png", "rating=s"]).rejects(post()) is None
+
+
+def test_stats_and_totals():
+    post_filter = PostFilter(["size<1KB", "-comic"])
+    post_filter.rejects(post(size=4096))
+    post_filter.rejects(post(size=512, tags=["comic"]))
+    post_filter.rejects(post(size=100))
+    assert post_filter.stats == {
+        "size<1KB": {'posts': 1, 'bytes': 4096},
+        "-comic": {'posts': 1, 'bytes': 512},
+    }
+    assert post_filter.totals() == (2, 4608)
+
+
+def test_empty_filter_is_falsy():
+    assert not PostFilter()
+    assert PostFilter(["score>0"])
+
+
+@pytest.mark.parametrize("rule", [
+    "score", "color=red", "score>=lots", "ext<png", "rating=x", "size<big", "",
+])
+def test_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        PostFilter([rule])
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from yiffscraper import ShardLeases, shard_query
+
+
+@pytest.fixture
+def leases(tmp_path):
+    leases = ShardLeases(str(tmp_path / "shards.db"))
+    yield leases
+    leases.close()
+
+
+def test_plan_splits_newest_first(leases):
+    assert leases.plan("fox", 250, 100) == 3
+    claimed = [leases.claim("fox", "w1", 60) for _ in range(4)]
+    assert claimed[:3] == [(1, 151, 250), (2, 51, 150), (3, 1, 50)]
+    assert claimed[3] is None
+
+
+def test_plan_keeps_existing_shards(leases):
+    leases.plan("Fox solo", 100, 50)
+    assert leases.plan("solo fox", 1000, 50) == 2
+    assert leases.summary("fox solo") == {'pending': {'shards': 2, 'downloaded': 0, 'bytes': 0}}
+
+
+def test_expired_lease_is_reclaimed(leases, monkeypatch):
+    leases.plan("fox", 100, 100)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    shard_id = leases.claim("fox", "w1", 30)[0]
+    assert leases.claim("fox", "w2", 30) is None
+
+    monkeypatch.setattr(time, "time", lambda: now + 31)
+    assert leases.claim("fox", "w2", 30)[0] == shard_id
+    # The first worker lost its lease and can neither renew nor finish it
+    assert not leases.heartbeat(shard_id, "w1", 30)
+    assert not leases.complete(shard_id, "w1", 10)
+    assert leases.complete(shard_id, "w2", 10, 2048)
+    assert leases.summary("fox") == {'done': {'shards': 1, 'downloaded': 10, 'bytes': 2048}}
+
+
+def test_heartbeat_extends_lease(leases, monkeypatch):
+    leases.plan("fox", 100, 100)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    shard_id = leases.claim("fox", "w1", 30)[0]
+
+    monkeypatch.setattr(time, "time", lambda: now + 20)
+    assert leases.heartbeat(shard_id, "w1", 30)
+    monkeypatch.setattr(time, "time", lambda: now + 40)
+    assert leases.claim("fox", "w2", 30) is None
+
+
+def test_release_fails_after_max_attempts(leases):
+    leases.plan("fox", 100, 100)
+    for attempt in range(3):
+        shard_id = leases.claim("fox", "w1", 30)[0]
+        leases.release(shard_id, "w1", downloaded=1, max_attempts=3)
+    assert leases.claim("fox", "w1", 30) is None
+    assert leases.summary("fox") == {'failed': {'shards': 1, 'downloaded': 3, 'bytes': 0}}
+
+    # Planning again retries failed shards
+    leases.plan("fox", 100, 100)
+    assert leases.claim("fox", "w1", 30) == (shard_id, 1, 100)
+
+
+def test_shard_query():
+    assert shard_query("fox solo", 1, 100) == "fox solo id:1..100"
+    assert shard_query("", 5, 9) == "id:5..9"
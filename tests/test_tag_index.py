@@ -0,0 +1,77 @@
+import pytest
+
+from yiffscraper import PostCatalog, TagIndex
+
+
+def post(post_id, rating, *tags):
+    return {'id': post_id, 'rating': rating, 'file': {'ext': 'png'}, 'tags': {'general': list(tags)}}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = PostCatalog(str(tmp_path / "catalog.db"))
+    catalog.upsert_posts([
+        post(1, 's', 'fox', 'solo'),
+        post(2, 'e', 'wolf', 'duo'),
+        post(3, 'q', 'fox', 'wolf', 'duo'),
+        post(4, 's', 'cat', 'solo', 'artist:someone'),
+        post(5, 's', 'fox', 'solo'),
+    ])
+    # Post 5 is listed but never downloaded, so the index leaves it out
+    catalog.mark_downloaded([(post_id, "Folders/test", f"{post_id}.png") for post_id in (1, 2, 3, 4)])
+    yield catalog
+    catalog.close()
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("fox", [1, 3]),
+    ("fox duo", [3]),
+    ("duo -fox", [2]),
+    ("~cat ~wolf", [2, 3, 4]),
+    ("solo ~cat ~fox", [1, 4]),
+    ("rating:safe", [1, 4]),
+    ("rating:e ~wolf ~cat", [2]),
+    ("-solo", [2, 3]),
+    ("f*", [1, 3]),
+    ("artist:someone", [4]),
+    ("FOX", [1, 3]),
+    ("dragon", []),
+    ("", [1, 2, 3, 4]),
+])
+def test_search(catalog, query, expected):
+    assert TagIndex(catalog).search(query) == expected
+
+
+def test_unindexed_metatag_and_rating(catalog):
+    index = TagIndex(catalog)
+    with pytest.raises(ValueError):
+        index.search("score:>10")
+    with pytest.raises(ValueError):
+        index.search("rating:awful")
+
+
+def test_rebuilds_when_downloads_change(catalog):
+    index = TagIndex(catalog)
+    assert index.search("fox") == [1, 3]
+    assert not index.is_stale()
+
+    catalog.mark_downloaded([(5, "Folders/test", "5.png")])
+    assert index.is_stale()
+    assert index.search("fox") == [1, 3, 5]
+
+
+def test_relisting_keeps_index_fresh(catalog):
+    index = TagIndex(catalog)
+    index.search("fox")
+    catalog.upsert_posts([post(1, 's', 'fox', 'solo'), post(6, 's', 'fox')])
+    assert not index.is_stale()
+
+    catalog.upsert_posts([post(1, 's', 'fox', 'solo', 'smile')])
+    assert index.is_stale()
+    assert index.search("smile") == [1]
+
+
+def test_loads_saved_index(catalog):
+    TagIndex(catalog).rebuild()
+    index = TagIndex(catalog)
+    assert index.search("wolf") == [2, 3]
@@ -0,0 +1,2151 @@
+"""
+YiffScraper engine: everything the command line scripts share, importable
+on its own so other programs can drive downloads in-process.
+
+    import asyncio
+    from yiffscraper import scrape
+
+    async def main():
+        async for result in scrape("wolf rating:s", 100, "Folders/wolf"):
+            print(result['post_id'], result['status'])
+
+    asyncio.run(main())
+
+Nothing here prompts or configures logging, and apart from ProgressBar and
+debug traces nothing prints: progress and reports go back to the caller.
+1.0.1.py, 1.0.0.py and 1.0.0-ios-linux.py are frontends over this module.
+"""
+import importlib.util
+import time
+import os
+import sys
+import logging
+import json
+import re
+import shutil
+import operator
+import functools
+from array import array
+import threading
+from threading import Lock
+from datetime import datetime
+from urllib.parse import urlsplit
+
+def lazy_import(name):
+    """Module object whose real import happens on first attribute access"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Heavy modules load on first use, so importing the engine stays cheap
+asyncio = lazy_import("asyncio")
+aiohttp = lazy_import("aiohttp")
+aiofiles = lazy_import("aiofiles")
+sqlite3 = lazy_import("sqlite3")
+hashlib = lazy_import("hashlib")
+
+HEADERS = {'User-Agent': 'Yiffscraper v4.1.0 CLI (by axo!)'}
+API_BASE = os.environ.get("E621_API_BASE", "https://e621.net")
+PAGE_DELAY = 1.0
+ID_BATCH_SIZE = 100
+# Bytes read per step when a download streams through a BandwidthLimiter
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+BASE_URL = "https://e621.net/posts.json?tags={}&limit={}"
+HISTORY_FILE = "download_history.jsonl"
+EVENT_LOG_FILE = "scraper_events.jsonl"
+CATALOG_FILE = "catalog.db"
+SHARD_FILE = "shards.db"
+PROFILE_DIR = "profiles"
+event_logger = logging.getLogger("yiffscraper.events")
+event_logger.propagate = False
+
+class JsonEventFormatter(logging.Formatter):
+    def format(self, record):
+        event = {'ts': round(record.created, 3)}
+        event.update(record.event)
+        return json.dumps(event, separators=(',', ':'))
+
+def start_event_log(path=EVENT_LOG_FILE):
+    """
+    Send per-download events to a JSONL file.
+    The event loop only pushes records onto a queue; a background listener
+    thread does the formatting and the file writes.
+    """
+    import logging.handlers
+    import queue
+    event_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(path, encoding='utf-8')
+    file_handler.setFormatter(JsonEventFormatter())
+    listener = logging.handlers.QueueListener(event_queue, file_handler)
+    queue_handler = logging.handlers.QueueHandler(event_queue)
+    event_logger.addHandler(queue_handler)
+    event_logger.setLevel(logging.INFO)
+    listener.start()
+    listener.queue_handler = queue_handler
+    return listener
+
+def stop_event_log(listener):
+    """Flush pending events and detach the queue handler"""
+    event_logger.removeHandler(listener.queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+def log_event(**fields):
+    if event_logger.handlers:
+        event_logger.info("download", extra={'event': fields})
+
+class StageProfiler:
+    """Accumulates coroutine wall time per pipeline stage"""
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.lock = Lock()
+
+    def add(self, stage, seconds):
+        if seconds is None:
+            return
+        with self.lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def report(self):
+        lines = [f"{'stage':<14}{'calls':>8}{'total s':>12}{'mean ms':>12}"]
+        for stage, total in sorted(self.totals.items(), key=lambda item: item[1], reverse=True):
+            count = self.counts[stage]
+            lines.append(f"{stage:<14}{count:>8}{total:>12.3f}{total / count * 1000:>12.2f}")
+        return "\n".join(lines)
+
+class StackSampler:
+    """
+    Minimal sampling profiler: a background thread snapshots every other
+    thread's stack at a fixed interval and counts collapsed stacks
+    (the format flamegraph.pl and speedscope read).
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(parts))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: item[1], reverse=True):
+                f.write(f"{stack} {count}\n")
+
+stage_profiler = None
+
+def record_stage(stage, seconds):
+    if stage_profiler is not None:
+        stage_profiler.add(stage, seconds)
+
+def run_profiled(coro, profile_dir=PROFILE_DIR, report_callback=None):
+    """
+    Run a coroutine under the profiler and write a ranked report plus a
+    collapsed-stack file, whose paths go to report_callback(report, collapsed).
+    Uses pyinstrument when installed, cProfile otherwise.
+    """
+    global stage_profiler
+    os.makedirs(profile_dir, exist_ok=True)
+    base = os.path.join(profile_dir, datetime.now().strftime("profile-%Y%m%d-%H%M%S"))
+
+    try:
+        import pyinstrument
+    except ImportError:
+        pyinstrument = None
+
+    stage_profiler = StageProfiler()
+    sampler = StackSampler()
+    sampler.start()
+    if pyinstrument:
+        profiler = pyinstrument.Profiler(async_mode='enabled')
+        profiler.start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start_time = time.perf_counter()
+    try:
+        return asyncio.run(coro)
+    finally:
+        if pyinstrument:
+            profiler.stop()
+        else:
+            profiler.disable()
+        wall = time.perf_counter() - start_time
+        sampler.stop()
+
+        with open(base + ".txt", 'w', encoding='utf-8') as f:
+            f.write(f"Wall time: {wall:.3f}s, stack samples: {sampler.samples}\n\n")
+            f.write("=== Pipeline stages (coroutine wall time) ===\n")
+            f.write(stage_profiler.report() + "\n\n")
+            if pyinstrument:
+                f.write("=== pyinstrument ===\n")
+                f.write(profiler.output_text(unicode=False, color=False))
+            else:
+                import pstats
+                profiler.dump_stats(base + ".prof")
+                stats = pstats.Stats(profiler, stream=f).strip_dirs()
+                f.write("=== cProfile by cumulative time ===\n")
+                stats.sort_stats('cumulative').print_stats(40)
+                f.write("=== cProfile by own time ===\n")
+                stats.sort_stats('tottime').print_stats(40)
+        sampler.write_collapsed(base + ".collapsed")
+        stage_profiler = None
+        if report_callback:
+            report_callback(base + ".txt", base + ".collapsed")
+
+class ProgressBar:
+    def __init__(self, total, width=50):
+        self.total = total
+        self.width = width
+        self.current = 0
+        self.start_time = time.time()
+        
+    def update(self, current):
+        self.current = current
+        percentage = (current / self.total) * 100 if self.total > 0 else 0
+        filled = int(self.width * current / self.total) if self.total > 0 else 0
+        bar = '█' * filled + '░' * (self.width - filled)
+        
+        elapsed = time.time() - self.start_time
+        if elapsed > 0 and current > 0:
+            speed = current / elapsed
+            eta = (self.total - current) / speed if speed > 0 else 0
+            eta_str = f"ETA: {int(eta)}s"
+        else:
+            eta_str = "ETA: --"
+            
+        print(f"\r[{bar}] {percentage:6.1f}% ({current}/{self.total}) {eta_str}", end='', flush=True)
+        
+    def finish(self):
+        self.update(self.total)
+        print()  
+
+class DownloadTracker:
+    def __init__(self, bandwidth=None):
+        self.bandwidth = bandwidth
+        self.downloaded_size = 0
+        self.total_estimated_size = 0
+        self.download_speed = 0
+        self.start_time = None
+        self.last_update_time = None
+        self.last_downloaded_size = 0
+        self.listed_size = 0
+        self.listed_count = 0
+        self.lock = Lock()
+        
+    def update_size(self, file_size):
+        with self.lock:
+            self.downloaded_size += file_size
+            current_time = time.time()
+            
+            if self.start_time is None:
+                self.start_time = current_time
+                self.last_update_time = current_time
+                
+            
+            if current_time - self.last_update_time >= 1.0:
+                time_diff = current_time - self.last_update_time
+                size_diff = self.downloaded_size - self.last_downloaded_size
+                self.download_speed = size_diff / time_diff
+                self.last_update_time = current_time
+                self.last_downloaded_size = self.downloaded_size
+    
+    def get_stats(self):
+        with self.lock:
+            downloaded_mb = self.downloaded_size / (1024 * 1024)
+            speed_mb = self.download_speed / (1024 * 1024)
+            return downloaded_mb, speed_mb
+
+    def get_utilization(self):
+        """(current byte rate, cap) of the bandwidth limiter, or None without a cap"""
+        if not self.bandwidth or not self.bandwidth.rate:
+            return None
+        return self.bandwidth.observed_rate(), self.bandwidth.rate
+
+    def add_listed_posts(self, posts, total_posts):
+        """Refine the total size estimate from the file sizes on a listing page"""
+        with self.lock:
+            for post in posts:
+                size = post.get('file', {}).get('size')
+                if size:
+                    self.listed_size += size
+                    self.listed_count += 1
+            if self.listed_count:
+                self.total_estimated_size = self.listed_size / self.listed_count * total_posts
+
+class DownloadHistory:
+    """
+    Download history stored as JSON Lines: one entry per line, appended in
+    O(1) per run. Entries are only parsed when `history` is first read, and a
+    torn last line left by a crash is skipped instead of breaking the file.
+    A legacy download_history.json next to it is migrated on first use.
+    """
+    def __init__(self, history_file=HISTORY_FILE):
+        self.history_file = history_file
+        self._history = None
+        self.migrate_legacy_history()
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = self.load_history()
+        return self._history
+
+    @history.setter
+    def history(self, entries):
+        self._history = entries
+
+    def migrate_legacy_history(self):
+        legacy_file = os.path.splitext(self.history_file)[0] + ".json"
+        if legacy_file == self.history_file or not os.path.exists(legacy_file) or os.path.exists(self.history_file):
+            return
+        try:
+            with open(legacy_file, 'r') as f:
+                entries = json.load(f)
+            self.write_entries(entries)
+            os.replace(legacy_file, legacy_file + ".bak")
+            logging.info(f"Migrated {len(entries)} history entries from {legacy_file}")
+        except Exception as e:
+            logging.error(f"Error migrating history: {e}")
+
+    def iter_entries(self):
+        """Stream entries from disk without keeping them in memory"""
+        if not os.path.exists(self.history_file):
+            return
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping unreadable history line {line_number} in {self.history_file}")
+
+    def load_history(self):
+        try:
+            return list(self.iter_entries())
+        except Exception as e:
+            logging.error(f"Error loading history: {e}")
+        return []
+
+    def write_entries(self, entries):
+        tmp_file = self.history_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.history_file)
+
+    def save_history(self):
+        """Rewrite (compact) the whole history file atomically"""
+        try:
+            self.write_entries(self.history)
+        except Exception as e:
+            logging.error(f"Error saving history: {e}")
+
+    def append_entry(self, entry):
+        try:
+            with open(self.history_file, 'ab') as f:
+                line = json.dumps(entry, separators=(',', ':')).encode('utf-8') + b"\n"
+                if f.tell() > 0:
+                    # Start on a fresh line if the previous writer died mid-line
+                    with open(self.history_file, 'rb') as tail:
+                        tail.seek(-1, os.SEEK_END)
+                        if tail.read(1) != b"\n":
+                            line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            logging.error(f"Error saving history: {e}")
+        if self._history is not None:
+            self._history.append(entry)
+
+    def add_entry(self, query_tags, count, total_size, duration, folder_name, skipped_duplicates=0, thread_count=None):
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'query_tags': query_tags,
+            'file_count': count,
+            'total_size_bytes': total_size,
+            'duration_seconds': duration,
+            'folder_name': folder_name,
+            'avg_speed_mbps': (total_size / (1024 * 1024)) / (duration / 60) if duration > 0 else 0,
+            'skipped_duplicates': skipped_duplicates,
+            'thread_count': thread_count
+        }
+        self.append_entry(entry)
+
+class PostCatalog:
+    """
+    Local SQLite catalog of post metadata. Listing pages are upserted in one
+    transaction each as they arrive, and downloads are marked with the folder
+    and file they were saved to, so later lookups need no API calls.
+    """
+    COLUMNS = ('id', 'md5', 'size', 'ext', 'rating', 'score', 'tags', 'file_url', 'width', 'height', 'data')
+
+    def __init__(self, path=CATALOG_FILE, store_raw=False):
+        self.path = path
+        self.store_raw = store_raw
+        # Shared by concurrent queries through asyncio.to_thread; every method holds the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "id INTEGER PRIMARY KEY, md5 TEXT, size INTEGER, ext TEXT, rating TEXT, score INTEGER, "
+            "tags TEXT, file_url TEXT, width INTEGER, height INTEGER, data TEXT, "
+            "updated_at TEXT, folder TEXT, filename TEXT, downloaded_at TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS posts_md5 ON posts (md5)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value)")
+        self.conn.execute("INSERT OR IGNORE INTO catalog_meta VALUES ('generation', 0)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sync_state (query TEXT PRIMARY KEY, max_id INTEGER, updated_at TEXT)")
+        self.conn.commit()
+
+    def bump_generation(self):
+        """Called when the downloaded posts or their tags change, so the tag index can tell it is stale"""
+        self.conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'generation'")
+
+    def generation(self):
+        with self.lock:
+            return self.conn.execute("SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone()[0]
+
+    @staticmethod
+    def post_tags(post):
+        return [tag for group in post.get('tags', {}).values() for tag in group]
+
+    def upsert_posts(self, posts):
+        if not posts:
+            return
+        now = datetime.now().isoformat()
+        rows = []
+        for post in posts:
+            file_info = post.get('file', {})
+            rows.append((
+                post['id'], file_info.get('md5'), file_info.get('size'), file_info.get('ext'),
+                post.get('rating'), post.get('score', {}).get('total'), " ".join(self.post_tags(post)),
+                file_info.get('url'), file_info.get('width'), file_info.get('height'),
+                json.dumps(post, separators=(',', ':')) if self.store_raw else None, now,
+            ))
+        updates = ", ".join(f"{column}=excluded.{column}" for column in self.COLUMNS[1:-1])
+        with self.lock, self.conn:
+            # Only a retag of an already downloaded post changes what the tag index covers
+            indexed = {post_id: (rating, tags) for post_id, rating, tags in self.conn.execute(
+                f"SELECT id, rating, tags FROM posts WHERE filename IS NOT NULL AND id IN ({', '.join('?' * len(rows))})",
+                [row[0] for row in rows])}
+            retagged = any(row[0] in indexed and indexed[row[0]] != (row[4], row[6]) for row in rows)
+            self.conn.executemany(
+                f"INSERT INTO posts ({', '.join(self.COLUMNS)}, updated_at) VALUES ({', '.join('?' * (len(self.COLUMNS) + 1))}) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}, data=COALESCE(excluded.data, data), updated_at=excluded.updated_at",
+                rows,
+            )
+            if retagged:
+                self.bump_generation()
+
+    def mark_downloaded(self, downloads):
+        """downloads: iterable of (post_id, folder, filename)"""
+        now = datetime.now().isoformat()
+        rows = [(folder, filename, now, post_id) for post_id, folder, filename in downloads]
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE posts SET folder=?, filename=?, downloaded_at=? WHERE id=?", rows)
+            self.bump_generation()
+
+    def get_sync_id(self, query_tags):
+        """Highest post id already synced for a query, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT max_id FROM sync_state WHERE query=?", (normalize_query(query_tags),)).fetchone()
+        return row[0] if row else None
+
+    def set_sync_id(self, query_tags, max_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state VALUES (?, ?, ?) ON CONFLICT(query) DO UPDATE SET "
+                "max_id=excluded.max_id, updated_at=excluded.updated_at",
+                (normalize_query(query_tags), max_id, datetime.now().isoformat()),
+            )
+
+    def get(self, post_id):
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM posts WHERE id=?", (post_id,))
+            row = cursor.fetchone()
+        return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    def query(self, sql, params=()):
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            names = [c[0] for c in cursor.description] if cursor.description else []
+            return names, cursor.fetchall()
+
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COUNT(filename), COALESCE(SUM(CASE WHEN filename IS NOT NULL THEN size END), 0), "
+                "COUNT(DISTINCT folder) FROM posts"
+            ).fetchone()
+        return {'posts': row[0], 'downloaded': row[1], 'downloaded_bytes': row[2], 'folders': row[3]}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+RATING_ALIASES = {'s': 's', 'safe': 's', 'q': 'q', 'questionable': 'q', 'e': 'e', 'explicit': 'e'}
+METATAG = re.compile(r"^\w+:.")
+
+class TagIndex:
+    """
+    Inverted tag index over the downloaded posts in the catalog.
+
+    Downloaded posts get dense positions (sorted by id). Each tag maps to
+    either a sorted uint32 array of positions (rare tags) or a bitmap (tags on
+    more than 1/32 of posts, where the bitmap is smaller). Queries load only
+    the tags they mention and combine them as Python int bitmaps, so AND/OR/NOT
+    run as a handful of word-wide bit operations even over millions of posts.
+    The index is rebuilt automatically when the catalog's downloads change.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.conn = catalog.conn
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tag_index (tag TEXT PRIMARY KEY, kind TEXT, count INTEGER, data BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tag_index_meta (key TEXT PRIMARY KEY, value)")
+        self.conn.commit()
+        self.ids = None
+        self.size = 0
+
+    def signature(self):
+        return self.catalog.generation()
+
+    def meta(self, key):
+        row = self.conn.execute("SELECT value FROM tag_index_meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def is_stale(self):
+        return self.meta('signature') != self.signature()
+
+    def rebuild(self):
+        positions = {}
+        ids = array('q')
+        rows = self.conn.execute(
+            "SELECT id, tags, rating FROM posts WHERE filename IS NOT NULL ORDER BY id")
+        for position, (post_id, tags, rating) in enumerate(rows):
+            ids.append(post_id)
+            for tag in (tags or "").split():
+                positions.setdefault(tag, []).append(position)
+            if rating:
+                positions.setdefault(f"rating:{rating}", []).append(position)
+
+        size = len(ids)
+        entries = []
+        for tag, tag_positions in positions.items():
+            if len(tag_positions) * 32 > size:
+                bitmap = bytearray((size + 7) // 8)
+                for position in tag_positions:
+                    bitmap[position >> 3] |= 1 << (position & 7)
+                entries.append((tag, 'b', len(tag_positions), bytes(bitmap)))
+            else:
+                entries.append((tag, 'a', len(tag_positions), array('I', tag_positions).tobytes()))
+
+        with self.conn:
+            self.conn.execute("DELETE FROM tag_index")
+            self.conn.executemany("INSERT INTO tag_index VALUES (?, ?, ?, ?)", entries)
+            self.conn.executemany("INSERT OR REPLACE INTO tag_index_meta VALUES (?, ?)", [
+                ('ids', ids.tobytes()),
+                ('signature', self.signature()),
+            ])
+        self.ids = ids
+        self.size = size
+        return size, len(entries)
+
+    def load(self):
+        if self.is_stale():
+            self.rebuild()
+        elif self.ids is None:
+            self.ids = array('q')
+            self.ids.frombytes(self.meta('ids') or b"")
+            self.size = len(self.ids)
+
+    def bitmap(self, tag):
+        row = self.conn.execute("SELECT kind, data FROM tag_index WHERE tag=?", (tag,)).fetchone()
+        if row is None:
+            return 0
+        kind, data = row
+        if kind == 'a':
+            positions = array('I')
+            positions.frombytes(data)
+            bits = bytearray((self.size + 7) // 8)
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            data = bits
+        return int.from_bytes(data, 'little')
+
+    def term_bitmap(self, term):
+        if term.startswith('rating:'):
+            rating = RATING_ALIASES.get(term[7:])
+            if rating is None:
+                raise ValueError(f"Unknown rating: {term}")
+            return self.bitmap(f"rating:{rating}")
+        if '*' in term:
+            result = 0
+            for (tag,) in self.conn.execute("SELECT tag FROM tag_index WHERE tag GLOB ?", (term,)):
+                result |= self.bitmap(tag)
+            return result
+        if METATAG.match(term) and not self.conn.execute("SELECT 1 FROM tag_index WHERE tag=?", (term,)).fetchone():
+            # Only tags and rating: are indexed; a tag that merely contains a colon is found above
+            raise ValueError(f"Metatag not supported offline: {term}")
+        return self.bitmap(term)
+
+    def search(self, query):
+        """Post ids matching an e621-style tag query (AND, -NOT, ~OR, rating:, wildcards)"""
+        self.load()
+        everything = (1 << self.size) - 1
+        result = everything
+        any_of = None
+        for term in query.lower().split():
+            if term.startswith('-') and len(term) > 1:
+                result &= ~self.term_bitmap(term[1:])
+            elif term.startswith('~') and len(term) > 1:
+                any_of = (any_of or 0) | self.term_bitmap(term[1:])
+            else:
+                result &= self.term_bitmap(term)
+            if not result:
+                return []
+        if any_of is not None:
+            result &= any_of
+        result &= everything
+        return self.decode(result)
+
+    def decode(self, bitmap):
+        ids = self.ids
+        matches = []
+        # Bits as a string, lowest position first; str.find skips the zeros in C
+        bits = bin(bitmap)[:1:-1]
+        position = bits.find('1')
+        while position != -1:
+            matches.append(ids[position])
+            position = bits.find('1', position + 1)
+        return matches
+
+class ShardLeases:
+    """
+    Lease table spreading one query over worker processes or machines: the
+    post ids are split into shards listed as "<query> id:low..high", and a
+    shard whose lease is not renewed goes back to the pool. Rollback journal
+    rather than WAL, so the file can live on shared storage.
+    """
+    def __init__(self, path=SHARD_FILE):
+        self.path = path
+        # Autocommit: every write below opens its own transaction
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            "id INTEGER PRIMARY KEY, query TEXT, low INTEGER, high INTEGER, status TEXT, "
+            "worker TEXT, expires REAL, attempts INTEGER DEFAULT 0, downloaded INTEGER DEFAULT 0, "
+            "bytes INTEGER DEFAULT 0, updated_at TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS shards_query ON shards (query, status)")
+
+    def plan(self, query_tags, max_id, shard_size, min_id=1):
+        """
+        Split ids min_id..max_id into shards (newest first); returns the shard
+        count. A query that already has shards keeps them, and its failed
+        shards go back to pending.
+        """
+        query = normalize_query(query_tags)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            count = self.conn.execute("SELECT COUNT(*) FROM shards WHERE query=?", (query,)).fetchone()[0]
+            if count:
+                self.conn.execute("UPDATE shards SET status='pending', attempts=0 WHERE query=? AND status='failed'",
+                                  (query,))
+            else:
+                now = datetime.now().isoformat()
+                rows = [(query, max(low, min_id), min(low + shard_size - 1, max_id), "pending", now)
+                        for low in range(max_id - shard_size + 1, min_id - shard_size, -shard_size)]
+                self.conn.executemany(
+                    "INSERT INTO shards (query, low, high, status, updated_at) VALUES (?, ?, ?, ?, ?)", rows)
+                count = len(rows)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def claim(self, query_tags, worker, ttl):
+        """Lease the newest pending (or expired) shard for `ttl` seconds; returns (id, low, high) or None"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT id, low, high FROM shards WHERE query=? AND "
+                "(status='pending' OR (status='leased' AND expires < ?)) ORDER BY high DESC LIMIT 1",
+                (normalize_query(query_tags), now)).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE shards SET status='leased', worker=?, expires=?, attempts=attempts+1, updated_at=? "
+                    "WHERE id=?", (worker, now + ttl, datetime.now().isoformat(), row[0]))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def heartbeat(self, shard_id, worker, ttl):
+        """Extend a lease; False if the worker no longer holds it"""
+        cursor = self.conn.execute(
+            "UPDATE shards SET expires=? WHERE id=? AND worker=? AND status='leased'",
+            (time.time() + ttl, shard_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, shard_id, worker, downloaded=0, size=0):
+        """Mark a leased shard done; False if the lease was lost meanwhile"""
+        cursor = self.conn.execute(
+            "UPDATE shards SET status='done', expires=NULL, downloaded=downloaded+?, bytes=bytes+?, updated_at=? "
+            "WHERE id=? AND worker=? AND status='leased'",
+            (downloaded, size, datetime.now().isoformat(), shard_id, worker))
+        return cursor.rowcount == 1
+
+    def release(self, shard_id, worker, downloaded=0, size=0, max_attempts=3):
+        """Give a shard back after a failed attempt; it is marked failed after `max_attempts` claims"""
+        self.conn.execute(
+            "UPDATE shards SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker=NULL, expires=NULL, downloaded=downloaded+?, bytes=bytes+?, updated_at=? "
+            "WHERE id=? AND worker=? AND status='leased'",
+            (max_attempts, downloaded, size, datetime.now().isoformat(), shard_id, worker))
+
+    def summary(self, query_tags):
+        """{status: {'shards', 'downloaded', 'bytes'}} for a query"""
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*), SUM(downloaded), SUM(bytes) FROM shards WHERE query=? GROUP BY status",
+            (normalize_query(query_tags),)).fetchall()
+        return {status: {'shards': shards, 'downloaded': downloaded or 0, 'bytes': size or 0}
+                for status, shards, downloaded, size in rows}
+
+    def close(self):
+        self.conn.close()
+
+def shard_query(query_tags, low, high):
+    return f"{query_tags} id:{low}..{high}".strip()
+
+def link_file(source, target):
+    """Hardlink source to target, copying instead across filesystems; True if it was linked"""
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        shutil.copy2(source, target)
+        return False
+
+def export_links(catalog, post_ids, target_folder):
+    """Hardlink the saved files of `post_ids` into target_folder (copies across filesystems)"""
+    os.makedirs(target_folder, exist_ok=True)
+    linked = copied = missing = 0
+    for post_id in post_ids:
+        post = catalog.get(post_id)
+        source = os.path.join(post['folder'], post['filename']) if post and post['filename'] else None
+        if not source or not os.path.exists(source):
+            missing += 1
+            continue
+        target = os.path.join(target_folder, post['filename'])
+        if os.path.exists(target):
+            continue
+        if link_file(source, target):
+            linked += 1
+        else:
+            copied += 1
+    return linked, copied, missing
+
+def normalize_query(query_tags):
+    return " ".join(sorted(query_tags.lower().split()))
+
+class HistoryStats:
+    """
+    Throughput aggregates over the download history, grouped by query, hour of
+    day and concurrency. They live in a sidecar index next to the history log
+    together with the byte offset already read, so each refresh only parses
+    entries appended since the last one.
+    """
+    MIN_RUNS = 2
+
+    def __init__(self, history):
+        self.history = history
+        self.index_file = os.path.splitext(history.history_file)[0] + ".index.json"
+        self.data = None
+
+    @staticmethod
+    def empty_index():
+        return {'offset': 0, 'all': {}, 'by_query': {}, 'by_hour': {}, 'by_concurrency': {}}
+
+    @staticmethod
+    def add_to_bucket(bucket, entry):
+        bucket['runs'] = bucket.get('runs', 0) + 1
+        bucket['files'] = bucket.get('files', 0) + (entry.get('file_count') or 0)
+        bucket['bytes'] = bucket.get('bytes', 0) + (entry.get('total_size_bytes') or 0)
+        bucket['seconds'] = bucket.get('seconds', 0.0) + (entry.get('duration_seconds') or 0)
+        bucket['last'] = entry.get('timestamp')
+
+    def add_entry(self, entry):
+        data = self.data
+        self.add_to_bucket(data['all'], entry)
+        query = normalize_query(entry.get('query_tags', ""))
+        self.add_to_bucket(data['by_query'].setdefault(query, {}), entry)
+        try:
+            hour = str(datetime.fromisoformat(entry['timestamp']).hour)
+            self.add_to_bucket(data['by_hour'].setdefault(hour, {}), entry)
+        except (KeyError, ValueError):
+            pass
+        if entry.get('thread_count'):
+            self.add_to_bucket(data['by_concurrency'].setdefault(str(entry['thread_count']), {}), entry)
+
+    def refresh(self):
+        """Bring the index up to date with the history log and return it"""
+        if self.data is None:
+            try:
+                with open(self.index_file, 'r') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                self.data = self.empty_index()
+
+        history_file = self.history.history_file
+        size = os.path.getsize(history_file) if os.path.exists(history_file) else 0
+        if size < self.data['offset']:
+            # The log was compacted or replaced: rebuild from scratch
+            self.data = self.empty_index()
+        if size == self.data['offset']:
+            return self.data
+
+        with open(history_file, 'rb') as f:
+            f.seek(self.data['offset'])
+            chunk = f.read(size - self.data['offset'])
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                self.add_entry(json.loads(line))
+            except ValueError:
+                continue
+        self.data['offset'] += len(complete)
+
+        try:
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            logging.warning(f"Could not save history index: {e}")
+        return self.data
+
+    @staticmethod
+    def throughput(bucket):
+        """(bytes per second, files per second) for a bucket, None when unknown"""
+        if not bucket or not bucket.get('seconds') or not bucket.get('files'):
+            return None
+        return bucket['bytes'] / bucket['seconds'], bucket['files'] / bucket['seconds']
+
+    def rates(self, query_tags, thread_count=None, when=None):
+        """
+        Expected throughput for a run, from past runs. Uses the same query
+        when it has enough history, then the same concurrency, then
+        everything, and scales by the hour-of-day factor when known.
+        """
+        data = self.refresh()
+        query_bucket = data['by_query'].get(normalize_query(query_tags))
+        candidates = [
+            ('query', query_bucket),
+            ('concurrency', data['by_concurrency'].get(str(thread_count))),
+            ('all', data['all']),
+        ]
+        basis, bucket = next(((name, b) for name, b in candidates
+                              if b and b.get('runs', 0) >= self.MIN_RUNS and self.throughput(b)),
+                             (None, None))
+        if bucket is None:
+            return None
+
+        size_bucket = query_bucket if query_bucket and query_bucket.get('files') else data['all']
+        bytes_per_file = size_bucket['bytes'] / size_bucket['files'] if size_bucket.get('files') else 0
+        bytes_per_second, files_per_second = self.throughput(bucket)
+
+        hour = str((when or datetime.now()).hour)
+        hour_rate = self.throughput(data['by_hour'].get(hour))
+        overall_rate = self.throughput(data['all'])
+        if hour_rate and overall_rate and data['by_hour'][hour]['runs'] >= self.MIN_RUNS:
+            factor = hour_rate[0] / overall_rate[0]
+            bytes_per_second *= factor
+            files_per_second *= factor
+
+        return {
+            'basis': basis,
+            'runs': bucket['runs'],
+            'bytes_per_file': bytes_per_file,
+            'bytes_per_second': bytes_per_second,
+            'files_per_second': files_per_second,
+        }
+
+    def predict(self, query_tags, post_count, thread_count=None, when=None, total_bytes=None):
+        """Predict size and duration of a run; pass total_bytes when it is already known"""
+        rates = self.rates(query_tags, thread_count, when)
+        if rates is None:
+            return None
+        estimated_bytes = total_bytes if total_bytes is not None else rates['bytes_per_file'] * post_count
+        if estimated_bytes and rates['bytes_per_second']:
+            seconds = estimated_bytes / rates['bytes_per_second']
+        else:
+            seconds = post_count / rates['files_per_second']
+        return {
+            'bytes': estimated_bytes,
+            'seconds': seconds,
+            'basis': rates['basis'],
+            'runs': rates['runs'],
+        }
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+
+class DuplicateDetector:
+    def __init__(self, download_folder):
+        self.download_folder = download_folder
+        self.file_hashes = {}
+        self.load_existing_hashes()
+
+    def get_file_hash(self, filepath):
+        hash_md5 = hashlib.md5()
+        try:
+            with open(filepath, "rb") as f:
+                for chunk in iter(lambda: f.read(4096), b""):
+                    hash_md5.update(chunk)
+            return hash_md5.hexdigest()
+        except Exception:
+            return None
+
+    def get_data_hash(self, data):
+        return hashlib.md5(data).hexdigest()
+
+    def load_existing_hashes(self, folder=None):
+        """Index a folder's files; pass `folder` to add another folder to the same index"""
+        folder = folder or self.download_folder
+        if not os.path.exists(folder):
+            return
+
+        for filename in os.listdir(folder):
+            filepath = os.path.join(folder, filename)
+            if os.path.isfile(filepath):
+                file_hash = self.get_file_hash(filepath)
+                if file_hash:
+                    self.file_hashes[file_hash] = filename
+
+    def is_duplicate(self, data, post_id):
+        return self.is_duplicate_hash(self.get_data_hash(data))
+
+    def is_duplicate_hash(self, data_hash):
+        if data_hash in self.file_hashes:
+            return True, self.file_hashes[data_hash]
+        return False, None
+
+    def add_hash(self, data, filename):
+        self.add_known_hash(self.get_data_hash(data), filename)
+
+    def add_known_hash(self, data_hash, filename):
+        self.file_hashes[data_hash] = filename
+
+def sanitize_folder_name(name):
+    """
+    Sanitize folder name for iOS/mobile compatibility.
+    Removes problematic characters and handles leading dots.
+    """
+    
+    name = name.replace(" ", "_").replace(":", "-").replace("\\", "-").replace("/", "-").replace("*", "-").replace('"', "'").replace("|", "-").replace("<", "-").replace(">", "-").replace("?", "-")
+    
+    
+    if name.startswith("."):
+        name = "dot_" + name[1:]  
+    
+    
+    if not name:
+        name = "unnamed_folder"
+    
+    return name
+
+async def download_file(sem, file_url, post_id, session, download_folder, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True, progress_callback=None, file_name=None, bandwidth=None):
+    """
+    Download one post to <file_name or post id>.<ext>; returns its event
+    dict (status: completed, duplicate or error). With a BandwidthLimiter
+    the body is streamed in chunks drawn from it.
+    """
+    queued_at = time.perf_counter()
+    event = {
+        'post_id': post_id,
+        'host': urlsplit(file_url).hostname,
+        'size': None,
+        'md5': None,
+        'status': "error",
+        'http_status': None,
+        'attempts': 0,
+        'queue_wait': None,
+        'ttfb': None,
+        'transfer': None,
+        'write': None,
+    }
+    async with sem:
+        started_at = time.perf_counter()
+        event['queue_wait'] = round(started_at - queued_at, 4)
+        # DownloadSlots keeps the running downloads for the control endpoint
+        in_flight = getattr(sem, 'in_flight', None)
+        if in_flight is not None:
+            in_flight[post_id] = (started_at, file_url)
+        try:
+            if debug:
+                print(f"\n[DEBUG] Downloading post {post_id} from {file_url}")
+
+            event['attempts'] += 1
+            async with session.get(file_url, headers=HEADERS, auth=auth, cookies=cookies) as response:
+                headers_at = time.perf_counter()
+                event['ttfb'] = round(headers_at - started_at, 4)
+                event['http_status'] = response.status
+                if response.status == 200:
+                    ext = file_url.split('.')[-1]
+                    fname = f"{file_name or post_id}.{ext}"
+                    path = os.path.join(download_folder, fname)
+                    if bandwidth:
+                        chunks = []
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await bandwidth.consume(len(chunk))
+                            chunks.append(chunk)
+                        data = b"".join(chunks)
+                    else:
+                        data = await response.read()
+                    event['transfer'] = round(time.perf_counter() - headers_at, 4)
+
+                    file_size = len(data)
+                    hash_started_at = time.perf_counter()
+                    data_hash = hashlib.md5(data).hexdigest()
+                    record_stage("md5", time.perf_counter() - hash_started_at)
+                    event['size'] = file_size
+                    event['md5'] = data_hash
+
+                    if duplicate_detector and skip_duplicates:
+                        is_dup, existing_file = duplicate_detector.is_duplicate_hash(data_hash)
+                        if is_dup:
+                            if debug:
+                                print(f"\n[DEBUG] Skipping duplicate {post_id} (matches {existing_file})")
+                            event['status'] = "duplicate"
+                            event['matches'] = existing_file
+                            return event
+
+                    if tracker:
+                        tracker.update_size(file_size)
+
+                    write_started_at = time.perf_counter()
+                    async with aiofiles.open(path, 'wb') as f:
+                        await f.write(data)
+                    event['write'] = round(time.perf_counter() - write_started_at, 4)
+
+                    if duplicate_detector:
+                        duplicate_detector.add_known_hash(data_hash, fname)
+
+                    if debug:
+                        print(f"\n[DEBUG] Saved {fname} ({file_size} bytes)")
+                    
+                    if progress_callback:
+                        progress_callback()
+
+                    event['status'] = "completed"
+                    event['path'] = path
+                    return event
+                else:
+                    if debug:
+                        print(f"\n[DEBUG] HTTP {response.status} for post {post_id}")
+                    return event
+        except Exception as e:
+            event['error'] = repr(e)
+            if debug:
+                print(f"\n[DEBUG] Exception {e}")
+            return event
+        finally:
+            if in_flight is not None:
+                in_flight.pop(post_id, None)
+            for stage in ('queue_wait', 'ttfb', 'transfer', 'write'):
+                record_stage(stage, event[stage])
+            log_event(**event)
+
+class RateLimiter:
+    """
+    Spaces out API calls so at most one starts every `interval` seconds,
+    however many queries share it. Defaults to PAGE_DELAY.
+    """
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.next_time = 0.0
+        self.lock = None
+
+    async def wait(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        interval = PAGE_DELAY if self.interval is None else self.interval
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            delay = self.next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_time = loop.time() + interval
+
+class BandwidthLimiter:
+    """
+    Token bucket on downloaded bytes, shared by every download it is given
+    to. Each chunk read draws its size from the bucket; once it runs dry the
+    reader sleeps under a FIFO lock, so concurrent downloads take turns chunk
+    by chunk instead of one fast connection eating the whole cap. `rate` is
+    bytes per second (None for no cap) and may be changed with set_rate while
+    downloads are running.
+    """
+    def __init__(self, rate=None, burst=0.25, window=2.0):
+        self.rate = rate or None
+        self.burst = burst
+        self.window = window
+        self.tokens = None
+        self.last_refill = None
+        self.lock = None
+        self.recent = []
+        self.recent_bytes = 0
+
+    def set_rate(self, rate):
+        self.rate = rate or None
+
+    async def consume(self, size):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            now = time.monotonic()
+            rate = self.rate
+            if not rate:
+                self.record(now, size)
+                return
+            capacity = rate * self.burst
+            if self.tokens is None:
+                # Start empty: a full bucket would let the first window run over the cap
+                self.tokens = 0.0
+            else:
+                self.tokens = min(capacity, self.tokens + (now - self.last_refill) * rate)
+            self.last_refill = now
+            self.tokens -= size
+            if self.tokens < 0:
+                # The sleep pays the debt back; the next refill counts it in
+                await asyncio.sleep(-self.tokens / rate)
+            # Counted once the bucket let it through, not while it was still waiting
+            self.record(time.monotonic(), size)
+
+    def record(self, now, size):
+        self.recent.append((now, size))
+        self.recent_bytes += size
+        self.prune(now)
+
+    def prune(self, now):
+        cutoff = now - self.window
+        expired = 0
+        while expired < len(self.recent) and self.recent[expired][0] < cutoff:
+            self.recent_bytes -= self.recent[expired][1]
+            expired += 1
+        if expired:
+            del self.recent[:expired]
+
+    def observed_rate(self):
+        """Bytes per second drawn over the last `window` seconds"""
+        self.prune(time.monotonic())
+        return self.recent_bytes / self.window
+
+class DownloadSlots:
+    """
+    Download concurrency limit that can be paused and resized while running,
+    usable wherever scrape() takes a semaphore (`download_slots`). Pausing
+    stops new downloads from starting; the ones in flight finish. It also
+    keeps the downloads in flight and how many are waiting for a slot.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.paused = False
+        self.in_flight = {}
+        self.condition = None
+
+    def get_condition(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    async def __aenter__(self):
+        condition = self.get_condition()
+        async with condition:
+            self.waiting += 1
+            try:
+                await condition.wait_for(lambda: not self.paused and self.active < self.limit)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        condition = self.get_condition()
+        async with condition:
+            self.active -= 1
+            condition.notify_all()
+
+    async def update(self, limit=None, paused=None):
+        """Change the limit and/or pause state; lowering the limit lets running downloads finish"""
+        condition = self.get_condition()
+        async with condition:
+            if limit is not None:
+                self.limit = limit
+            if paused is not None:
+                self.paused = paused
+            condition.notify_all()
+
+class FairSlots:
+    """
+    Download slots shared by several jobs and handed out round-robin between
+    the jobs that are waiting, so a job with hundreds of queued downloads
+    can't starve one with a few. job(key) gives the semaphore-like view a
+    job passes to scrape() as `download_slots`.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.queues = {}
+
+    def job(self, key):
+        return JobSlots(self, key)
+
+    def waiting(self, key=None):
+        if key is not None:
+            return len(self.queues.get(key, ()))
+        return sum(len(waiters) for waiters in self.queues.values())
+
+    async def acquire(self, key):
+        if self.active < self.limit and not self.queues:
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(key, []).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancel: pass it on
+                self.release()
+            else:
+                waiters = self.queues.get(key, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self.queues[key]
+            raise
+
+    def release(self):
+        # dicts keep insertion order: the job at the front gets the slot and goes to the back
+        while self.queues:
+            key = next(iter(self.queues))
+            waiters = self.queues.pop(key)
+            waiter = waiters.pop(0)
+            if waiters:
+                self.queues[key] = waiters
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+class JobSlots:
+    """One job's view of FairSlots"""
+    def __init__(self, slots, key):
+        self.slots = slots
+        self.key = key
+
+    async def __aenter__(self):
+        await self.slots.acquire(self.key)
+
+    async def __aexit__(self, *exc_info):
+        self.slots.release()
+
+class ControlServer:
+    """
+    Localhost HTTP endpoint for tuning a running scrape without restarting it:
+
+        GET  /state                 in-flight downloads, queue depth and tracker stats as JSON
+        POST /pause, /resume        stop / restart starting new downloads
+        POST /concurrency?limit=8   change the number of parallel downloads
+        POST /bandwidth?rate=40MB   change the byte rate cap (rate=0 lifts it)
+
+    It is served by the scrape's own event loop: start() it before the run
+    and stop() it afterwards. Port 0 picks a free port (see `port`).
+    """
+    def __init__(self, slots, tracker=None, bandwidth=None, host="127.0.0.1", port=0):
+        self.slots = slots
+        self.tracker = tracker
+        self.bandwidth = bandwidth
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    def state(self):
+        now = time.perf_counter()
+        slots = self.slots
+        state = {
+            'paused': slots.paused,
+            'concurrency': slots.limit,
+            'active': slots.active,
+            'queued': slots.waiting,
+            'in_flight': [{'post_id': post_id, 'url': url, 'seconds': round(now - started_at, 2)}
+                          for post_id, (started_at, url) in list(slots.in_flight.items())],
+        }
+        if self.tracker:
+            tracker = self.tracker
+            state['downloaded_bytes'] = tracker.downloaded_size
+            state['estimated_total_bytes'] = round(tracker.total_estimated_size)
+            state['speed_bytes_per_s'] = round(tracker.download_speed)
+        if self.bandwidth:
+            rate = self.bandwidth.observed_rate()
+            state['bandwidth'] = {
+                'cap_bytes_per_s': self.bandwidth.rate,
+                'observed_bytes_per_s': round(rate),
+                'utilization': round(rate / self.bandwidth.rate, 3) if self.bandwidth.rate else None,
+            }
+        return state
+
+    async def start(self):
+        from aiohttp import web
+
+        async def get_state(request):
+            return web.json_response(self.state())
+
+        async def pause(request):
+            await self.slots.update(paused=True)
+            return web.json_response(self.state())
+
+        async def resume(request):
+            await self.slots.update(paused=False)
+            return web.json_response(self.state())
+
+        async def concurrency(request):
+            try:
+                limit = int(request.query['limit'])
+            except (KeyError, ValueError):
+                return web.json_response({'error': "limit must be a positive integer"}, status=400)
+            if limit <= 0:
+                return web.json_response({'error': "limit must be a positive integer"}, status=400)
+            await self.slots.update(limit=limit)
+            return web.json_response(self.state())
+
+        async def bandwidth(request):
+            if not self.bandwidth:
+                return web.json_response({'error': "this run has no bandwidth limiter"}, status=409)
+            try:
+                self.bandwidth.set_rate(parse_size(request.query['rate']))
+            except (KeyError, ValueError):
+                return web.json_response({'error': "rate must be a size such as 40MB (0 for no cap)"}, status=400)
+            return web.json_response(self.state())
+
+        app = web.Application()
+        app.router.add_get('/state', get_state)
+        app.router.add_post('/pause', pause)
+        app.router.add_post('/resume', resume)
+        app.router.add_post('/concurrency', concurrency)
+        app.router.add_post('/bandwidth', bandwidth)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+async def fetch_posts_page(session, query_tags, limit, page, debug=False, rate_limiter=None):
+    """Fetch one posts.json page; returns the post list, or None on failure"""
+    if rate_limiter:
+        await rate_limiter.wait()
+    params = {
+        "tags": query_tags,
+        "limit": str(limit),
+        "page": str(page)
+    }
+
+    if debug:
+        print(f"\n[DEBUG] GET posts.json → params={params!r}")
+
+    listing_started_at = time.perf_counter()
+    try:
+        async with session.get(
+                f"{API_BASE}/posts.json",
+                params=params,
+                headers=HEADERS
+        ) as resp:
+            if resp.status != 200:
+                if debug:
+                    print(f"\n[DEBUG] HTTP {resp.status} — stopping")
+                return None
+            body = await resp.read()
+        decode_started_at = time.perf_counter()
+        record_stage("listing", decode_started_at - listing_started_at)
+        data = json.loads(body)
+        record_stage("json_decode", time.perf_counter() - decode_started_at)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        if debug:
+            print(f"\n[DEBUG] Listing failed: {e!r} — stopping")
+        return None
+    return data.get("posts", [])
+
+class ListingError(Exception):
+    """A listing page failed (HTTP error, network error or bad JSON)"""
+
+async def iter_post_pages(session, query_tags, limit=320, debug=False, after_id=None, rate_limiter=None, strict=False):
+    """
+    Yield listing pages until the query is exhausted, paging by id cursor
+    (numbered pages for order: queries). `limit` is a page size or a
+    function returning it; with `after_id` only newer posts are listed,
+    oldest first. A failed page ends the listing, or raises ListingError
+    with `strict`.
+    """
+    use_cursor = "order:" not in query_tags or after_id is not None
+    page_number = 1
+    cursor = after_id
+    while True:
+        page_limit = limit() if callable(limit) else limit
+        if page_limit <= 0:
+            return
+        if after_id is not None:
+            page = f"a{cursor}"
+        else:
+            page = f"b{cursor}" if use_cursor and cursor else page_number
+        posts = await fetch_posts_page(session, query_tags, page_limit, page, debug, rate_limiter)
+        if posts is None and strict:
+            raise ListingError(f"Listing page {page} of {query_tags!r} failed")
+        if not posts:
+            if debug and posts is not None:
+                print(f"\n[DEBUG] No posts on page {page_number} — stopping")
+            return
+        if after_id is not None:
+            posts.sort(key=lambda post: post["id"])
+
+        yield posts
+
+        if len(posts) < page_limit:
+            if debug:
+                print(f"\n[DEBUG] Only {len(posts)} posts on page {page_number} (<{page_limit}) — done")
+            return
+        if after_id is not None:
+            cursor = max(post["id"] for post in posts)
+        else:
+            cursor = min(post["id"] for post in posts)
+        page_number += 1
+        if rate_limiter is None:
+            await asyncio.sleep(PAGE_DELAY)
+
+POST_URL_ID = re.compile(r"/posts/(\d+)")
+MD5_TOKEN = re.compile(r"\b[0-9a-fA-F]{32}\b")
+
+def parse_post_list(text):
+    """
+    Pull post ids and md5s out of free-form text: bare ids, md5s, post page
+    URLs (…/posts/123) and file URLs (…/<md5>.png), separated by whitespace
+    or commas. Returns (ids, md5s) in first-seen order without repeats.
+    """
+    ids, md5s = {}, {}
+    for token in re.split(r"[\s,]+", text):
+        if not token:
+            continue
+        if token.isdigit():
+            ids[int(token)] = None
+            continue
+        post_match = POST_URL_ID.search(token)
+        md5_match = MD5_TOKEN.search(token)
+        if post_match:
+            ids[int(post_match.group(1))] = None
+        elif md5_match:
+            md5s[md5_match.group(0).lower()] = None
+    return list(ids), list(md5s)
+
+async def iter_post_batches(session, post_ids=(), md5s=(), debug=False, rate_limiter=None, batch_size=ID_BATCH_SIZE):
+    """
+    Resolve post ids and md5s to post dicts, `batch_size` values per
+    posts.json request (id:1,2,3 / md5:a,b,c). Missing or deleted posts are
+    simply absent; a failed batch is skipped rather than ending the run.
+    """
+    batches = [("id", list(post_ids)), ("md5", list(md5s))]
+    first = True
+    for tag, values in batches:
+        for start in range(0, len(values), batch_size):
+            if not first and rate_limiter is None:
+                await asyncio.sleep(PAGE_DELAY)
+            first = False
+            batch = values[start:start + batch_size]
+            posts = await fetch_posts_page(session, f"{tag}:{','.join(map(str, batch))}", len(batch), 1,
+                                           debug, rate_limiter)
+            if posts is None:
+                logging.warning(f"Could not resolve {len(batch)} {tag} values starting at {batch[0]}")
+                continue
+            if posts:
+                yield posts
+
+async def fetch_pool(session, pool_id, kind="pools", debug=False, rate_limiter=None):
+    """
+    Fetch a pool (kind="pools") or post set (kind="post_sets") with its
+    ordered post_ids in a single request; returns the dict, or None on failure
+    """
+    if rate_limiter:
+        await rate_limiter.wait()
+    try:
+        async with session.get(f"{API_BASE}/{kind}/{pool_id}.json", headers=HEADERS) as resp:
+            if resp.status != 200:
+                if debug:
+                    print(f"\n[DEBUG] HTTP {resp.status} for {kind}/{pool_id}")
+                return None
+            return json.loads(await resp.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        if debug:
+            print(f"\n[DEBUG] Fetching {kind}/{pool_id} failed: {e!r}")
+        return None
+
+def page_file_names(post_ids):
+    """Zero-padded page numbers in pool order (001_<id>, 002_<id>, ...) so files sort as pages"""
+    width = max(3, len(str(len(post_ids))))
+    return {post_id: f"{page:0{width}d}_{post_id}" for page, post_id in enumerate(post_ids, 1)}
+
+# Subfolder (of the download folder) each file variant is saved in
+VARIANT_FOLDERS = {'original': "", 'sample': "samples", 'preview': "previews"}
+VARIANT_FILE = re.compile(r"^(?:.*_)?(\d+)\.\w+$")
+
+class VariantPolicy:
+    """
+    Which file of a post to download: "original", "sample", "preview" or
+    e.g. "sample>20MB" (the sample only when the original is bigger).
+    Samples and previews are saved under samples/ and previews/.
+    """
+    def __init__(self, policy="original"):
+        self.policy = policy
+        name, _, threshold = policy.strip().lower().partition('>')
+        name = name.strip()
+        if name not in VARIANT_FOLDERS or (threshold and name != 'sample'):
+            raise ValueError(f"Invalid variant policy: {policy!r} (original, sample, preview or sample>SIZE)")
+        self.variant = name
+        self.threshold = parse_size(threshold) if threshold else None
+
+    def choose(self, post):
+        """(variant, url) to download for a post; url is None if there is nothing to download"""
+        file_info = post.get("file", {})
+        sample = post.get("sample", {})
+        if self.variant == 'preview':
+            return 'preview', post.get("preview", {}).get("url")
+        if self.variant == 'sample' and sample.get("has") and sample.get("url"):
+            if self.threshold is None or (file_info.get("size") or 0) > self.threshold:
+                return 'sample', sample["url"]
+        if file_info.get("url"):
+            return 'original', file_info["url"]
+        # Originals hidden from anonymous users may still have a sample
+        return 'sample', sample.get("url")
+
+    @staticmethod
+    def file_size(post, variant):
+        """Listed size of the original; samples and previews only list pixels, so theirs is scaled from it"""
+        file_info = post.get("file", {})
+        size = file_info.get("size")
+        if variant == 'original' or not size:
+            return size
+        scaled = post.get(variant, {})
+        pixels = (file_info.get("width") or 0) * (file_info.get("height") or 0)
+        if not pixels or not scaled.get("width") or not scaled.get("height"):
+            return None
+        return min(size, size * scaled["width"] * scaled["height"] // pixels)
+
+def variant_post_files(download_folder):
+    """{post id: [paths]} of the samples and previews saved under a download folder"""
+    files = {}
+    for variant, subfolder in VARIANT_FOLDERS.items():
+        folder = os.path.join(download_folder, subfolder)
+        if variant == 'original' or not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            match = VARIANT_FILE.match(name)
+            if match:
+                files.setdefault(int(match.group(1)), []).append(os.path.join(folder, name))
+    return files
+
+FILTER_FIELDS = {
+    'ext': lambda post: post.get('file', {}).get('ext'),
+    'size': lambda post: post.get('file', {}).get('size'),
+    'width': lambda post: post.get('file', {}).get('width'),
+    'height': lambda post: post.get('file', {}).get('height'),
+    'score': lambda post: post.get('score', {}).get('total'),
+    'favs': lambda post: post.get('fav_count'),
+    'rating': lambda post: post.get('rating'),
+    'tags': lambda post: set(PostCatalog.post_tags(post)),
+}
+FILTER_RULE = re.compile(r"^(\w+)\s*(<=|>=|!=|=|<|>)\s*(.+)$")
+FILTER_COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+                      '=': operator.eq, '!=': operator.ne}
+
+def parse_size(value):
+    """Parse '512KB', '20MB', '1.5GB' or a plain byte count"""
+    value = str(value).strip().upper()
+    for suffix, factor in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024), ('B', 1)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(float(value))
+
+class PostFilter:
+    """
+    Client-side rules checked against listing metadata before a download is
+    queued, e.g. size<20MB  ext!=webm,gif  score>=50  rating=s  tags!=comic.
+    -tag is short for tags!=tag; posts without a rule's field are kept, and
+    `stats` holds what each rule dropped.
+    """
+    def __init__(self, rules=()):
+        self.rules = [(rule, self.compile(rule)) for rule in rules]
+        self.stats = {rule: {'posts': 0, 'bytes': 0} for rule, _ in self.rules}
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    @staticmethod
+    def compile(rule):
+        """Predicate for one rule; it returns False for posts to drop"""
+        rule = rule.strip()
+        if rule.startswith('-') and len(rule) > 1:
+            rule = f"tags!={rule[1:]}"
+
+        match = FILTER_RULE.match(rule)
+        field = match.group(1).lower() if match else None
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Invalid filter rule: {rule!r} (fields: {', '.join(FILTER_FIELDS)})")
+        op, value = match.group(2), match.group(3)
+        get = FILTER_FIELDS[field]
+
+        if field in ('ext', 'rating', 'tags'):
+            if op not in ('=', '!='):
+                raise ValueError(f"Invalid filter rule: {rule!r} ({field} only supports = and !=)")
+            values = {v.strip().lower() for v in value.split(',') if v.strip()}
+            if field == 'ext':
+                values = {v.lstrip('.') for v in values}
+            if field == 'rating':
+                if not values <= set(RATING_ALIASES):
+                    raise ValueError(f"Unknown rating in filter rule: {rule!r}")
+                values = {RATING_ALIASES[v] for v in values}
+            wanted = op == '='
+            if field == 'tags':
+                return lambda post: bool(get(post) & values) == wanted
+            return lambda post: get(post) is None or (get(post) in values) == wanted
+
+        try:
+            number = parse_size(value) if field == 'size' else float(value)
+        except ValueError:
+            raise ValueError(f"Invalid filter rule: {rule!r} ({value!r} is not a number)")
+        compare = FILTER_COMPARISONS[op]
+        return lambda post: get(post) is None or compare(get(post), number)
+
+    def rejects(self, post):
+        """The first rule the post fails (counted in stats), or None to keep it"""
+        for rule, check in self.rules:
+            if not check(post):
+                stats = self.stats[rule]
+                stats['posts'] += 1
+                stats['bytes'] += post.get('file', {}).get('size') or 0
+                return rule
+        return None
+
+    def totals(self):
+        """(posts, bytes) dropped by all rules together"""
+        return (sum(s['posts'] for s in self.stats.values()),
+                sum(s['bytes'] for s in self.stats.values()))
+
+class SharedDownloads:
+    """
+    Files claimed by concurrent queries, keyed by (post id, variant): the
+    first query downloads a file and the others hardlink it. Failed or
+    unlinkable files are fetched again; job() views release their entries
+    when closed.
+    """
+    def __init__(self):
+        self.files = {}
+        self.holders = {}
+        self.linked = 0
+
+    def job(self):
+        return SharedJob(self)
+
+    def claim(self, key, held=None):
+        """None if the caller should download the file, else a future for the owner's file path"""
+        if held is not None and key not in held:
+            held.add(key)
+            self.holders[key] = self.holders.get(key, 0) + 1
+        future = self.files.get(key)
+        if future is None:
+            self.files[key] = asyncio.get_running_loop().create_future()
+        return future
+
+    def finish(self, key, path, future=None):
+        future = future or self.files.get(key)
+        if future is None or future.done():
+            return
+        if path is None and self.files.get(key) is future:
+            # Nothing to link: the next claim downloads the file again
+            del self.files[key]
+        future.set_result(path)
+
+    def release(self, held):
+        """Forget the files only the scrapes behind `held` still listed"""
+        for key in held:
+            self.holders[key] -= 1
+            if not self.holders[key]:
+                del self.holders[key]
+                self.files.pop(key, None)
+        held.clear()
+
+    async def fetch(self, key, download, download_folder):
+        future = self.files[key]
+        result = None
+        try:
+            result = await download
+        finally:
+            path = None
+            if result and result['status'] == "completed":
+                path = result['path']
+            elif result and result['status'] == "duplicate":
+                path = os.path.join(download_folder, result['matches'])
+            self.finish(key, path, future)
+        return result
+
+    async def link(self, key, download_folder, download, progress_callback=None, held=None):
+        """Hardlink the owner's file into download_folder, downloading it here if that fails"""
+        while True:
+            future = self.claim(key, held)
+            if future is None:
+                return await self.fetch(key, download(), download_folder)
+            # Shielded: cancelling this query must not cancel the other waiters
+            source = await asyncio.shield(future)
+            if source is None:
+                continue
+            target = os.path.join(download_folder, os.path.basename(source))
+            try:
+                if not os.path.exists(target):
+                    await asyncio.to_thread(link_file, source, target)
+            except OSError:
+                # The owner's file was moved or deleted since
+                if self.files.get(key) is future:
+                    del self.files[key]
+                continue
+            self.linked += 1
+            if progress_callback:
+                progress_callback()
+            return {'post_id': key[0], 'status': "linked", 'path': target, 'source': source}
+
+class SharedJob:
+    """One job's view of SharedDownloads; close() releases what it listed"""
+    def __init__(self, shared):
+        self.shared = shared
+        self.held = set()
+
+    def claim(self, key):
+        return self.shared.claim(key, self.held)
+
+    def finish(self, key, path):
+        self.shared.finish(key, path)
+
+    def fetch(self, key, download, download_folder):
+        return self.shared.fetch(key, download, download_folder)
+
+    def link(self, key, download_folder, download, progress_callback=None):
+        return self.shared.link(key, download_folder, download, progress_callback, self.held)
+
+    def close(self):
+        self.shared.release(self.held)
+
+async def scrape(query_tags, total_images=320, download_folder=None, thread_limit=5, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True, catalog=None, sync=False, session=None, rate_limiter=None, download_slots=None, shared=None, post_ids=None, md5s=None, file_names=None, post_filter=None, variant_policy=None, bandwidth=None, strict_listing=False):
+    """
+    Download up to `total_images` new files for a query, or exactly the
+    posts in `post_ids` / `md5s`, yielding one result dict per post as it
+    finishes: post_id, status (completed, duplicate, linked or error) and
+    variant; downloads add path, size, md5 and the event log timings.
+    """
+    download_folder = download_folder or os.path.join("Folders", sanitize_folder_name(query_tags))
+    if session is None:
+        async with aiohttp.ClientSession(auth=auth, cookies=cookies) as session:
+            async for result in scrape(
+                    query_tags, total_images, download_folder, thread_limit, debug, auth, cookies,
+                    tracker, duplicate_detector, skip_duplicates, catalog, sync, session, rate_limiter,
+                    download_slots, shared, post_ids, md5s, file_names, post_filter, variant_policy, bandwidth, strict_listing):
+                yield result
+        return
+
+    from_list = post_ids is not None or md5s is not None
+    sync = sync and not from_list
+    variant_policy = variant_policy or VariantPolicy()
+    variant_folders = {'original': download_folder}
+    variant_detectors = {'original': duplicate_detector}
+
+    def variant_target(variant):
+        """Folder and duplicate index for a variant, created on first use"""
+        if variant not in variant_folders:
+            folder = os.path.join(download_folder, VARIANT_FOLDERS[variant])
+            os.makedirs(folder, exist_ok=True)
+            variant_folders[variant] = folder
+            variant_detectors[variant] = DuplicateDetector(folder) if duplicate_detector else None
+        return variant_folders[variant], variant_detectors[variant]
+
+    os.makedirs(download_folder, exist_ok=True)
+    sem = download_slots or asyncio.Semaphore(thread_limit)
+    downloaded = 0
+    page = 0
+    since_id = catalog.get_sync_id(query_tags) if sync and catalog else None
+    listed_max = since_id or 0
+    failed_min = None
+
+    def update_progress():
+        nonlocal downloaded
+        downloaded += 1
+
+    def remaining():
+        return total_images - downloaded
+
+    def save_sync_checkpoint():
+        checkpoint = failed_min - 1 if failed_min is not None else listed_max
+        if checkpoint > (since_id or 0):
+            catalog.set_sync_id(query_tags, checkpoint)
+
+    if debug and sync:
+        print(f"\n[DEBUG] Sync: listing posts after id {since_id}" if since_id else "\n[DEBUG] Sync: first run")
+
+    async def wanted_posts(pages):
+        """
+        Full listing pages, handed out no more than the files still wanted at
+        a time; the rest of a page waits for the next round instead of being
+        listed again with a smaller limit.
+        """
+        async for listed in pages:
+            if not any(variant_policy.choose(post)[1] for post in listed):
+                if debug:
+                    print(f"\n[DEBUG] No download URLs found on page {page + 1} — stopping")
+                return
+            while listed and remaining() > 0:
+                want = remaining()
+                yield listed[:want]
+                listed = listed[want:]
+            if remaining() <= 0:
+                return
+
+    if from_list:
+        pages = iter_post_batches(session, post_ids or (), md5s or (), debug, rate_limiter)
+    else:
+        pages = wanted_posts(iter_post_pages(session, query_tags, 320, debug, since_id, rate_limiter, strict_listing))
+
+    async for posts in pages:
+        page += 1
+        if tracker and variant_policy.variant == 'original':
+            tracker.add_listed_posts(posts, total_images)
+        if catalog:
+            await asyncio.to_thread(catalog.upsert_posts, posts)
+
+        downloads = []
+        # Nothing is yielded until the page's tasks exist, so a consumer that stops early
+        # leaves no coroutine unawaited and no shared claim unresolved
+        skipped = []
+        claimed = []
+        variants = {}
+        for post in posts:
+            variant, file_url = variant_policy.choose(post)
+            if not file_url:
+                continue
+            if post_filter:
+                rule = post_filter.rejects(post)
+                if rule:
+                    log_event(post_id=post["id"], status="filtered", rule=rule, size=post.get("file", {}).get("size"))
+                    continue
+            folder, detector = variant_target(variant)
+            variants[post["id"]] = variant
+            file_name = file_names.get(post["id"]) if file_names else None
+            download = functools.partial(
+                download_file, sem, file_url, post["id"], session,
+                folder, debug, auth, cookies,
+                tracker, detector, skip_duplicates,
+                update_progress, file_name, bandwidth
+            )
+            shared_key = (post["id"], variant)
+            if shared and shared.claim(shared_key) is not None:
+                downloads.append(shared.link(shared_key, folder, download, update_progress))
+                continue
+            known_md5 = post.get("file", {}).get("md5")
+            if skip_duplicates and duplicate_detector and known_md5:
+                # The listing already tells us the md5: skip local files without downloading them.
+                # An original on disk also covers its sample and preview.
+                is_dup, existing_file = duplicate_detector.is_duplicate_hash(known_md5)
+                existing_path = os.path.join(download_folder, existing_file) if is_dup else None
+                if not is_dup and variant != 'original':
+                    # Samples and previews have no md5 in the listing, only their file name
+                    existing_file = f"{file_name or post['id']}.{file_url.split('.')[-1]}"
+                    existing_path = os.path.join(folder, existing_file)
+                    is_dup = os.path.exists(existing_path)
+                if is_dup:
+                    if shared:
+                        shared.finish(shared_key, existing_path)
+                    event = {'post_id': post["id"], 'host': urlsplit(file_url).hostname, 'size': post["file"].get("size"),
+                             'md5': known_md5, 'status': "duplicate", 'attempts': 0, 'matches': existing_file,
+                             'variant': variant}
+                    log_event(**event)
+                    skipped.append(event)
+                    continue
+            if shared:
+                claimed.append(shared_key)
+                downloads.append(shared.fetch(shared_key, download(), folder))
+            else:
+                downloads.append(download())
+
+        if debug:
+            print(f"\n[DEBUG] Page {page}: scheduling {len(downloads)} downloads")
+
+        tasks = [asyncio.ensure_future(download) for download in downloads]
+        completed = []
+        failed = []
+        try:
+            for event in skipped:
+                yield event
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                result['variant'] = variants.get(result['post_id'], 'original')
+                if result['status'] == "completed":
+                    completed.append((result['post_id'], os.path.dirname(result['path']),
+                                      os.path.basename(result['path'])))
+                elif result['status'] == "error":
+                    failed.append(result['post_id'])
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            # A task cancelled before it started never reaches fetch(); let its waiters download instead
+            for key in claimed:
+                shared.finish(key, None)
+
+        if catalog:
+            await asyncio.to_thread(catalog.mark_downloaded, completed)
+
+        if sync and catalog:
+            listed_max = max(listed_max, max(post["id"] for post in posts))
+            if failed:
+                failed_min = min(failed + ([failed_min] if failed_min is not None else []))
+            if since_id is not None:
+                await asyncio.to_thread(save_sync_checkpoint)
+
+        if debug:
+            print(f"\n[DEBUG] Total downloaded: {downloaded}")
+
+    if sync and catalog and since_id is None:
+        # First sync lists newest first, so only record a checkpoint once it is done
+        save_sync_checkpoint()
+
+    if debug:
+        print("\n[DEBUG] Scraping complete.")
+
+async def start_scraper(query_tags, total_images, thread_limit, download_folder, debug=False, auth=None, cookies=None, tracker=None, duplicate_detector=None, skip_duplicates=True, catalog=None, sync=False, session=None, rate_limiter=None, download_slots=None, shared=None, post_filter=None, variant_policy=None, bandwidth=None):
+    """Run scrape() to the end; returns (downloaded or linked, skipped duplicates)"""
+    downloaded = 0
+    skipped_duplicates = 0
+    async for result in scrape(query_tags, total_images, download_folder, thread_limit, debug, auth, cookies,
+                               tracker, duplicate_detector, skip_duplicates, catalog, sync, session,
+                               rate_limiter, download_slots, shared, post_filter=post_filter,
+                               variant_policy=variant_policy, bandwidth=bandwidth):
+        if result['status'] in ("completed", "linked"):
+            downloaded += 1
+        elif result['status'] == "duplicate":
+            skipped_duplicates += 1
+    return downloaded, skipped_duplicates
+
+async def plan_download(query_tags, total_images, download_folder, auth=None, debug=False, post_filter=None, variant_policy=None, after_id=None):
+    """
+    Dry run: walk the listing (metadata only) and work out exactly which
+    files are still missing locally, without downloading anything.
+    `after_id` is a sync checkpoint, as in scrape().
+    """
+    local_hashes = DuplicateDetector(download_folder).file_hashes
+    variant_policy = variant_policy or VariantPolicy()
+    plan = {
+        'listed': 0,
+        'unavailable': 0,
+        'filtered': 0,
+        'filtered_bytes': 0,
+        'local_files': 0,
+        'local_bytes': 0,
+        'files': 0,
+        'bytes': 0,
+        'unknown_size': 0,
+        'estimated_size': 0,
+        'pages': 0,
+    }
+
+    async with aiohttp.ClientSession(auth=auth) as session:
+        async for posts in iter_post_pages(session, query_tags, 320, debug, after_id):
+            plan['pages'] += 1
+            for post in posts:
+                if plan['files'] >= total_images:
+                    break
+                plan['listed'] += 1
+                variant, file_url = variant_policy.choose(post)
+                if not file_url:
+                    plan['unavailable'] += 1
+                    continue
+                size = variant_policy.file_size(post, variant) or 0
+                if post_filter and post_filter.rejects(post):
+                    plan['filtered'] += 1
+                    plan['filtered_bytes'] += size
+                    continue
+                # Same checks as scrape(): an original on disk also covers its sample and preview
+                is_local = post.get('file', {}).get('md5') in local_hashes
+                if not is_local and variant != 'original':
+                    name = f"{post['id']}.{file_url.split('.')[-1]}"
+                    is_local = os.path.exists(os.path.join(download_folder, VARIANT_FOLDERS[variant], name))
+                if is_local:
+                    plan['local_files'] += 1
+                    plan['local_bytes'] += size
+                    continue
+                plan['files'] += 1
+                plan['bytes'] += size
+                if not size:
+                    plan['unknown_size'] += 1
+                elif variant != 'original':
+                    plan['estimated_size'] += 1
+            if plan['files'] >= total_images:
+                break
+    return plan
+
+class JsonlPostWriter:
+    """Writes raw post dicts to a JSON Lines file, replacing an earlier export like the SQLite upsert does"""
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, posts):
+        self.file.write("".join(json.dumps(post, separators=(',', ':')) + "\n" for post in posts))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+async def export_metadata(query_tags, output, output_format=None, limit=0, auth=None, debug=False, progress_callback=None):
+    """
+    Page through a query and stream every post dict to JSONL or SQLite
+    without downloading any media; progress_callback gets the running count.
+    Pages go through a small bounded queue to a writer thread, so disk
+    writes overlap with the next listing request.
+    """
+    output_format = output_format or ('sqlite' if output.endswith(('.db', '.sqlite', '.sqlite3')) else 'jsonl')
+    if output_format == 'sqlite':
+        writer = PostCatalog(output, store_raw=True)
+        write_page = writer.upsert_posts
+    else:
+        writer = JsonlPostWriter(output)
+        write_page = writer.write
+    pages = asyncio.Queue(maxsize=4)
+    exported = 0
+
+    async def write_pages():
+        while True:
+            posts = await pages.get()
+            if posts is None:
+                return
+            await asyncio.to_thread(write_page, posts)
+
+    async def put_page(posts):
+        """Queue a page, raising the writer's error instead of waiting on a writer that died"""
+        put = asyncio.ensure_future(pages.put(posts))
+        await asyncio.wait((put, writer_task), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        if writer_task.done():
+            writer_task.result()
+
+    def page_size():
+        return 320 if not limit else min(320, limit - exported)
+
+    writer_task = asyncio.create_task(write_pages())
+    try:
+        async with aiohttp.ClientSession(auth=auth) as session:
+            async for posts in iter_post_pages(session, query_tags, page_size, debug):
+                await put_page(posts)
+                exported += len(posts)
+                if progress_callback:
+                    progress_callback(exported)
+    finally:
+        if not writer_task.done():
+            await put_page(None)
+            await writer_task
+        writer.close()
+    return exported
+
+def credentials_from_env():
+    """(username, api_key) from E621_USERNAME / E621_API_KEY, or (None, None)"""
+    username = os.environ.get("E621_USERNAME")
+    api_key = os.environ.get("E621_API_KEY")
+    if username and api_key:
+        return username, api_key
+    return None, None
+
+def zip_folder(src_folder, dest_zip_file):
+    from zipfile import ZipFile
+    with ZipFile(dest_zip_file, 'w') as zipf:
+        for foldername, _, filenames in os.walk(src_folder):
+            for filename in filenames:
+                filepath = os.path.join(foldername, filename)
+                arcname = os.path.relpath(filepath, src_folder)
+                zipf.write(filepath, arcname)
+
+def format_size(bytes_size):
+    """Convert bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.1f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.1f} TB"
+
+async def check_credentials(username, api_key):
+    """HTTP status of a one-post request made with these credentials"""
+    async with aiohttp.ClientSession(auth=aiohttp.BasicAuth(username, api_key)) as session:
+        async with session.get(f"{API_BASE}/posts.json", params={'tags': "rating:safe", 'limit': 1},
+                               headers=HEADERS) as response:
+            return response.status
+